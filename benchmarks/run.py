@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+# ---------------------
+
+import json
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+from typing import *
+
+import click
+
+from benchmarks.synthetic import make_sequence
+
+# registered benchmarks, in dependency order: (name, unit, function)
+# every function takes the sequence folder and returns the number of processed units
+BENCHMARKS = []  # type: List[Tuple[str, str, Callable[[str], int]]]
+
+# number of (evenly spaced) frames rendered by the `overlay_sample` benchmark
+OVERLAY_SAMPLE_FRAMES = 50
+
+
+def benchmark(name, unit):
+    """
+    Register a benchmark; `unit` is the unit of its throughput (e.g. 'rows', 'frames')
+    """
+
+    def register(fn):
+        BENCHMARKS.append((name, unit, fn))
+        return fn
+
+    return register
+
+
+def _paths(seq_dir):
+    # type: (str) -> Dict[str, str]
+    name = os.path.basename(seq_dir)
+    return {
+        'csv': os.path.join(seq_dir, 'coords.csv'),
+        'json': os.path.join(seq_dir, f'{name}.json'),
+        'xml': os.path.join(seq_dir, f'{name}_CVAT.xml'),
+        'coco': os.path.join(seq_dir, f'{name}.coco.json'),
+        'mp4': os.path.join(seq_dir, f'{name}.mp4'),
+        'render': os.path.join(seq_dir, f'res_{name}_cvat.mp4'),
+        # outside of `seq_dir`: images saved there would be taken for frames of the sequence
+        'stills': os.path.join(os.path.dirname(seq_dir), f'res_{name}_cvat_sample'),
+        'overlay': os.path.join(os.path.dirname(seq_dir), f'res_{name}_cvat_frames.mp4'),
+    }
+
+
+@benchmark('csv2json', 'rows')
+def bench_csv_to_jta(seq_dir):
+    from utils.annotation_handler import csv_to_jta
+    out_path = csv_to_jta(seq_dir)
+    with open(_paths(seq_dir)['csv']) as f:
+        return sum(1 for _ in f) - 1 if os.path.isfile(out_path) else 0
+
+
+@benchmark('json2cvat', 'frames')
+def bench_json_to_cvat(seq_dir):
+    from utils.CVAT_style import json_imavis_style_conversion
+    from utils.sequence_cache import cache_paths
+
+    # cold run: the binary cache is rebuilt
+    for path in cache_paths(_paths(seq_dir)['json']):
+        if os.path.isfile(path):
+            os.remove(path)
+    json_imavis_style_conversion(_paths(seq_dir)['json'], seq_dir, verbose=False)
+    return _n_frames(seq_dir)
+
+
+@benchmark('json2coco', 'frames')
+def bench_json_to_coco(seq_dir):
+    from utils.coco_style_convert import convert_sequence
+    convert_sequence(_paths(seq_dir)['json'], _paths(seq_dir)['coco'], verbose=False)
+    return _n_frames(seq_dir)
+
+
+@benchmark('cvat_parse', 'frames')
+def bench_cvat_parse(seq_dir):
+    from path import Path
+    from utils.ann_visualization.utils_imavis import iter_cvat_images_xml
+    return sum(1 for _ in iter_cvat_images_xml(Path(_paths(seq_dir)['xml'])))
+
+
+@benchmark('frames2video', 'frames')
+def bench_frames_to_video(seq_dir):
+    from utils.frames_seq_to_video import frames_to_video, get_file_folder_list
+    frames_to_video(seq_dir, _paths(seq_dir)['mp4'], show=False)
+    return len(get_file_folder_list(seq_dir))
+
+
+@benchmark('reproject', 'rows')
+def bench_reproject(seq_dir):
+    from utils.projection import JTA_INTRINSICS, reproject_sequence
+    from utils.geometry import FrameSize
+    from utils.sequence_cache import load_sequence
+    return len(reproject_sequence(load_sequence(_paths(seq_dir)['json']), JTA_INTRINSICS.scaled(FrameSize(960, 540))))
+
+
+@benchmark('tracks', 'rows')
+def bench_tracks(seq_dir):
+    from utils.sequence_cache import load_sequence
+    from utils.track_index import TrackIndex
+    index = TrackIndex(load_sequence(_paths(seq_dir)['json']))
+    index.summary()
+    return len(index.data)
+
+
+@benchmark('overlay', 'frames')
+def bench_overlay(seq_dir):
+    from utils.ann_visualization.visualize import visualize
+    visualize(_paths(seq_dir)['mp4'], _paths(seq_dir)['xml'], _paths(seq_dir)['render'], hide=True)
+    return _n_frames(seq_dir)
+
+
+@benchmark('overlay_sample', 'frames')
+def bench_overlay_sample(seq_dir):
+    from utils.ann_visualization.visualize import visualize
+    out_dir = _paths(seq_dir)['stills']
+    frames = visualize(_paths(seq_dir)['mp4'], _paths(seq_dir)['xml'], out_dir, hide=True,
+                       max_frames=OVERLAY_SAMPLE_FRAMES, stills=True)
+    return len(frames)
+
+
+@benchmark('overlay_frames', 'frames')
+def bench_overlay_frames(seq_dir):
+    from utils.ann_visualization.overlay import overlay_frames
+    out_path = _paths(seq_dir)['overlay']
+    overlay_frames(seq_dir, out_path, xml_file_path=_paths(seq_dir)['xml'], workers=os.cpu_count())
+    return _n_frames(seq_dir)
+
+
+def _n_frames(seq_dir):
+    # type: (str) -> int
+    from utils.sequence_cache import load_sequence
+    return len(set(load_sequence(_paths(seq_dir)['json'])['frame'].tolist()))
+
+
+def run_benchmarks(seq_dir, names=None, memory=False):
+    # type: (str, Optional[Sequence[str]], bool) -> List[Dict]
+    """
+    Run the (selected) benchmarks on a sequence folder
+
+    :param seq_dir: sequence folder (see `make_sequence`)
+    :param names: names of the benchmarks to run; default: all (their inputs are produced by the previous ones)
+    :param memory: if True, each benchmark is run a second time under `tracemalloc` to measure its peak memory
+    :return: one result per benchmark: name, seconds, units, throughput [units/s] and peak memory [MB]
+    """
+    results = []
+    for name, unit, fn in BENCHMARKS:
+        if names and name not in names:
+            continue
+
+        t0 = time.perf_counter()
+        n_units = fn(seq_dir)
+        seconds = time.perf_counter() - t0
+
+        result = {
+            'name': name,
+            'seconds': seconds,
+            'units': n_units,
+            'unit': unit,
+            'throughput': n_units / seconds if seconds > 0 else float('inf'),
+            'peak_mb': None,
+        }
+
+        if memory:
+            tracemalloc.start()
+            fn(seq_dir)
+            result['peak_mb'] = tracemalloc.get_traced_memory()[1] / 2 ** 20
+            tracemalloc.stop()
+
+        results.append(result)
+        peak = f'{result["peak_mb"]:9.1f} MB' if result['peak_mb'] is not None else ''
+        print(f'▸ {name:<14s} {seconds:8.3f}s {result["throughput"]:12.1f} {unit}/s {peak}')
+
+    return results
+
+
+H1 = 'number of frames of the synthetic sequence'
+H2 = 'number of pedestrians per frame'
+H3 = 'probability of a joint being occluded'
+H4 = 'fraction of pedestrians walking outside the frame'
+H5 = 'benchmark to run (can be repeated); default: all'
+H6 = 'also measure the peak memory of each benchmark (tracemalloc)'
+H7 = 'path of the JSON report'
+
+
+@click.command()
+@click.option('--frames', 'n_frames', type=int, default=100, show_default=True, help=H1)
+@click.option('--peds', 'n_peds', type=int, default=20, show_default=True, help=H2)
+@click.option('--occlusion', 'occlusion_ratio', type=float, default=0.3, show_default=True, help=H3)
+@click.option('--offscreen', 'offscreen_ratio', type=float, default=0.1, show_default=True, help=H4)
+@click.option('--bench', 'names', type=click.Choice([b[0] for b in BENCHMARKS]), multiple=True, help=H5)
+@click.option('--memory/--no-memory', default=False, help=H6)
+@click.option('--out', 'out_path', type=click.Path(), default=None, help=H7)
+def main(n_frames, n_peds, occlusion_ratio, offscreen_ratio, names, memory, out_path):
+    """
+    Benchmarks of the conversion pipelines on a synthetic JTA sequence
+    """
+    root = tempfile.mkdtemp(prefix='jta_bench_')
+    try:
+        with_frames = not names or any(n in names for n in ('frames2video', 'overlay', 'overlay_sample',
+                                                            'overlay_frames'))
+        seq_dir = make_sequence(root, n_frames=n_frames, n_peds=n_peds, occlusion_ratio=occlusion_ratio,
+                                offscreen_ratio=offscreen_ratio, with_frames=with_frames)
+        print(f'▸ synthetic sequence: {n_frames} frames, {n_peds} pedestrians per frame')
+
+        # the inputs of the selected benchmarks are produced by the previous ones
+        if names:
+            first = min([b[0] for b in BENCHMARKS].index(n) for n in names)
+            for _, _, fn in BENCHMARKS[:first]:
+                fn(seq_dir)
+
+        results = run_benchmarks(seq_dir, names=names, memory=memory)
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+    if out_path is not None:
+        report = {
+            'params': {
+                'frames': n_frames,
+                'peds': n_peds,
+                'occlusion': occlusion_ratio,
+                'offscreen': offscreen_ratio,
+            },
+            'results': results,
+        }
+        with open(out_path, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+# ---------------------
+
+import os
+from typing import *
+
+import cv2
+import numpy as np
+import pandas as pd
+
+from utils.annotation_handler import JTA_dataset_cols
+
+# focal length [px] of the synthetic camera, as the JTA camera
+FOCAL_LENGTH = 1158.
+
+# 2D offsets [px] of the 22 JTA joints (see `Joint.NAMES`) for a person 100 px tall,
+# relative to the center of the pose
+SKELETON_TEMPLATE = np.array([
+    (0, -50),  # head_top
+    (0, -45),  # head_center
+    (0, -38),  # neck
+    (-4, -37),  # right_clavicle
+    (-9, -35),  # right_shoulder
+    (-12, -20),  # right_elbow
+    (-13, -6),  # right_wrist
+    (4, -37),  # left_clavicle
+    (9, -35),  # left_shoulder
+    (12, -20),  # left_elbow
+    (13, -6),  # left_wrist
+    (0, -32),  # spine0
+    (0, -24),  # spine1
+    (0, -16),  # spine2
+    (0, -8),  # spine3
+    (0, 0),  # spine4
+    (-6, 2),  # right_hip
+    (-6, 25),  # right_knee
+    (-6, 50),  # right_ankle
+    (6, 2),  # left_hip
+    (6, 25),  # left_knee
+    (6, 50),  # left_ankle
+], dtype=np.float64)
+
+
+def make_sequence_array(n_frames=100, n_peds=20, occlusion_ratio=0.3, offscreen_ratio=0.1,
+                        width=1920, height=1080, seed=0):
+    # type: (int, int, float, float, int, int, int) -> np.ndarray
+    """
+    Deterministic synthetic JTA sequence: `n_peds` pedestrians walking in every frame
+
+    :param n_frames: number of frames
+    :param n_peds: number of pedestrians per frame
+    :param occlusion_ratio: probability of a joint being occluded
+    :param offscreen_ratio: fraction of the pedestrians walking (partially) outside the frame
+    :param width: frame width [px]
+    :param height: frame height [px]
+    :param seed: random seed
+    :return: (n_frames * n_peds * 22, 10) array with the JTA columns (see `JTA_dataset_cols`)
+    """
+    rng = np.random.default_rng(seed)
+
+    # per-pedestrian trajectory: start position, velocity, distance from the camera
+    distance = rng.uniform(5, 60, n_peds)
+    scale = (FOCAL_LENGTH * 1.8 / distance) / 100  # a 1.8 m tall person seen with the synthetic camera
+    start = np.stack([rng.uniform(0, width, n_peds), rng.uniform(0.3 * height, height, n_peds)], axis=1)
+    velocity = rng.normal(0, 3, (n_peds, 2))
+    offscreen = rng.random(n_peds) < offscreen_ratio
+    start[offscreen, 0] = np.where(rng.random(offscreen.sum()) < 0.5, -0.05 * width, 1.05 * width)
+
+    frames = np.arange(n_frames)
+    centers = start[None, :, :] + frames[:, None, None] * velocity[None, :, :]  # (frames, peds, 2)
+    pos2d = centers[:, :, None, :] + SKELETON_TEMPLATE[None, None, :, :] * scale[None, :, None, None]
+    pos2d += rng.normal(0, 1, pos2d.shape)
+
+    # 3D camera coordinates [m]
+    z3d = np.broadcast_to(distance[None, :, None], pos2d.shape[:3])
+    x3d = (pos2d[..., 0] - width / 2) * z3d / FOCAL_LENGTH
+    y3d = (pos2d[..., 1] - height / 2) * z3d / FOCAL_LENGTH
+
+    shape = pos2d.shape[:3]
+    occluded = rng.random(shape) < occlusion_ratio
+    self_occluded = rng.random(shape) < occlusion_ratio / 3
+
+    columns = [
+        np.broadcast_to(frames[:, None, None], shape),
+        np.broadcast_to(np.arange(n_peds)[None, :, None], shape),
+        np.broadcast_to(np.arange(22)[None, None, :], shape),
+        pos2d[..., 0], pos2d[..., 1], x3d, y3d, z3d,
+        occluded, self_occluded,
+    ]
+    return np.stack([np.asarray(c, dtype=np.float64).ravel() for c in columns], axis=1)
+
+
+def write_frames(seq_dir, n_frames, width=1920, height=1080, seed=0):
+    # type: (str, int, int, int, int) -> List[str]
+    """
+    Write `n_frames` deterministic JPEG frames (`0.jpg`, `1.jpg`, ...) in `seq_dir`
+
+    :return: paths of the frames
+    """
+    rng = np.random.default_rng(seed)
+    background = rng.integers(0, 256, (height // 8, width // 8, 3), dtype=np.uint8)
+    background = cv2.resize(background, (width, height), interpolation=cv2.INTER_LINEAR)
+
+    paths = []
+    for frame_number in range(n_frames):
+        frame = np.roll(background, 4 * frame_number, axis=1)
+        path = os.path.join(seq_dir, f'{frame_number}.jpg')
+        cv2.imwrite(path, frame)
+        paths.append(path)
+    return paths
+
+
+def make_sequence(root, seq_number=1, n_frames=100, n_peds=20, occlusion_ratio=0.3, offscreen_ratio=0.1,
+                  width=1920, height=1080, with_frames=True, seed=0):
+    # type: (str, int, int, int, float, float, int, int, bool, int) -> str
+    """
+    Write a synthetic sequence folder `<root>/seq_<seq_number>` with `coords.csv`
+    (with the vertical field of view of the camera in its `fov` column, as in the captured
+    sequences) and (optionally) its JPEG frames, laid out as a captured sequence
+
+    :return: path of the sequence folder
+    """
+    seq_dir = os.path.join(root, f'seq_{seq_number}')
+    os.makedirs(seq_dir, exist_ok=True)
+
+    data = make_sequence_array(n_frames, n_peds, occlusion_ratio, offscreen_ratio, width, height, seed)
+    df = pd.DataFrame(data, columns=JTA_dataset_cols)
+    for col in ['frame', 'pedestrian_id', 'joint_type', 'occluded', 'self_occluded']:
+        df[col] = df[col].astype(np.int64)
+    df['fov'] = np.degrees(2 * np.arctan((height / 2) / FOCAL_LENGTH))
+    df.to_csv(os.path.join(seq_dir, 'coords.csv'), index=False)
+
+    if with_frames:
+        write_frames(seq_dir, n_frames, width, height, seed)
+
+    return seq_dir
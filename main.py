@@ -1,8 +1,357 @@
-import pandas as pd
+# -*- coding: utf-8 -*-
+# ---------------------
 
+import os
+import sys
 
-# Press the green button in the gutter to run the script.
-if __name__ == '__main__':
+import click
+
+from utils.batch_convert import TASKS
+from utils.profiling import Profiler
+
+# check python version
+assert sys.version_info >= (3, 6), '[!] This script requires Python >= 3.6'
+
+# conversion modules (and their heavy dependencies: pandas, matplotlib, imageio, ...)
+# are imported inside the commands, so that every command only pays for what it uses
+
+H_REPORT = 'path of the JSON report with the timings of each stage'
+H_PROFILE = 'also profile the run with cProfile (slower); needs `--report`'
+H_WORKERS = 'number of worker processes'
+H_VERBOSE = 'print the conversion progress'
+
+
+@click.group()
+@click.option('--report', 'report_path', type=click.Path(dir_okay=False), default=None, help=H_REPORT)
+@click.option('--profile/--no-profile', default=False, help=H_PROFILE)
+@click.pass_context
+def cli(ctx, report_path, profile):
+    """
+    Conversion tools of the JTA-style synthetic dataset
+    """
+    profiler = Profiler(ctx.invoked_subcommand or 'run', profile=profile)
+    ctx.obj = profiler
+
+    # `pipeline` writes its own report, with the timings of every conversion of every sequence
+    if report_path is not None and ctx.invoked_subcommand != 'pipeline':
+        ctx.call_on_close(lambda: print(f'▸ report: \'{os.path.abspath(profiler.save(report_path))}\''))
+
+
+def run_profiled(ctx, fn, *args, **kwargs):
+    """
+    Call `fn(*args, **kwargs, profiler=...)` with the profiler of the CLI run
+    """
+    profiler = ctx.obj  # type: Profiler
+    with profiler:
+        return fn(*args, profiler=profiler, **kwargs)
+
+
+@cli.command()
+@click.argument('seq_dir', type=click.Path(exists=True, file_okay=False))
+@click.option('--out', 'out_path', type=click.Path(dir_okay=False), default=None,
+              help='path of the output JSON; default: `<seq_dir>/<seq_name>.json`')
+@click.option('--engine', type=click.Choice(['c', 'pyarrow']), default='c', show_default=True,
+              help='pandas CSV engine')
+@click.pass_context
+def csv2jta(ctx, seq_dir, out_path, engine):
+    """
+    Convert the `coords.csv` of a sequence to the JTA JSON
+    """
+    from utils.annotation_handler import csv_to_jta
+
+    profiler = ctx.obj  # type: Profiler
+    with profiler, profiler.stage('convert'):
+        out_path = csv_to_jta(seq_dir, out_path, engine=engine)
+    print(f'▸ JTA annotations: \'{os.path.abspath(out_path)}\'')
+
+
+@cli.command()
+@click.argument('json_path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--out_folder', type=click.Path(file_okay=False), default=None,
+              help='folder of the output CVAT XML; default: the folder of `json_path`')
+@click.option('--workers', type=int, default=1, show_default=True, help=H_WORKERS)
+@click.option('--verbose/--quiet', default=True, help=H_VERBOSE)
+@click.pass_context
+def cvat(ctx, json_path, out_folder, workers, verbose):
+    """
+    Convert the JTA JSON of a sequence (e.g. `seq_3.json`) to CVAT XML
+    """
+    from utils.CVAT_style import json_imavis_style_conversion
+
+    out_folder = os.path.dirname(os.path.abspath(json_path)) if out_folder is None else out_folder
+    out_path = run_profiled(ctx, json_imavis_style_conversion, json_path, out_folder, verbose=verbose,
+                            workers=workers)
+    if verbose:
+        print()
+    print(f'▸ CVAT annotations: \'{os.path.abspath(out_path)}\'')
+
+
+@cli.command()
+@click.argument('json_paths', nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False))
+@click.option('--out', 'out_path', type=click.Path(dir_okay=False), default=None,
+              help='path of the output COCO JSON; default: `<seq_name>.coco.json` next to the (single) input')
+@click.option('--split', 'split_name', type=str, default=None,
+              help='name of the split; required to convert many sequences into a single COCO file')
+@click.option('--workers', type=int, default=1, show_default=True, help=H_WORKERS)
+@click.option('--frame_stride', type=int, default=1, show_default=True,
+              help='only one frame every `frame_stride` frames is converted')
+@click.option('--max_frames', type=int, default=None, help='maximum number of (evenly spaced) frames per sequence')
+@click.option('--verbose/--quiet', default=True, help=H_VERBOSE)
+@click.pass_context
+def coco(ctx, json_paths, out_path, split_name, workers, frame_stride, max_frames, verbose):
+    """
+    Convert the JTA JSON of one or more sequences to COCO JSON
+    """
+    from utils.coco_style_convert import convert_sequence, convert_split
+
+    if len(json_paths) == 1 and split_name is None:
+        json_path = json_paths[0]
+        if out_path is None:
+            out_path = os.path.splitext(json_path)[0] + '.coco.json'
+        run_profiled(ctx, convert_sequence, json_path, out_path, verbose=verbose, workers=workers,
+                     frame_stride=frame_stride, max_frames=max_frames)
+    else:
+        if split_name is None or out_path is None:
+            raise click.UsageError('`--split` and `--out` are required to convert many sequences')
+        run_profiled(ctx, convert_split, json_paths, out_path, split_name, verbose=verbose, workers=workers,
+                     frame_stride=frame_stride, max_frames=max_frames)
+    print(f'▸ COCO annotations: \'{os.path.abspath(out_path)}\'')
+
+
+@cli.command()
+@click.argument('seq_dir', type=click.Path(exists=True, file_okay=False))
+@click.option('--out', 'out_path', type=click.Path(dir_okay=False), default=None,
+              help='path of the output video; default: `<seq_dir>/<seq_name>.mp4`')
+@click.option('--fps', type=int, default=20, show_default=True, help='frame rate of the output video')
+@click.option('--width', type=int, default=None, help='width of the output video; default: the width of the frames')
+@click.option('--height', type=int, default=None, help='height of the output video; default: the height of the frames')
+@click.option('--show/--no-show', default=False, help='display the frames while encoding')
+@click.pass_context
+def video(ctx, seq_dir, out_path, fps, width, height, show):
+    """
+    Encode the numbered frames of a sequence folder into a video
+    """
+    from utils.frames_seq_to_video import frames_to_video
+
+    if out_path is None:
+        out_path = os.path.join(seq_dir, f'{os.path.basename(os.path.normpath(seq_dir))}.mp4')
+    run_profiled(ctx, frames_to_video, seq_dir, out_path, fps_video=fps, width=width, height=height, show=show)
+    print(f'▸ video: \'{os.path.abspath(out_path)}\'')
+
+
+def default_render_path(seq_dir, name, stills):
+    # type: (str, str, bool) -> str
+    """
+    :return: `<seq_dir>/res_<name>_cvat.mp4` or, for stills, the folder `res_<name>_cvat` next to `seq_dir`
+        (stills saved inside `seq_dir` would be taken for frames of the sequence)
+    """
+    if stills:
+        return os.path.join(os.path.dirname(os.path.normpath(seq_dir)), f'res_{name}_cvat')
+    return os.path.join(seq_dir, f'res_{name}_cvat.mp4')
+
+
+@cli.command()
+@click.argument('mp4_path', type=click.Path(exists=True, dir_okay=False))
+@click.argument('xml_path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--out', 'out_path', type=click.Path(dir_okay=False), default=None,
+              help='path of the output video; default: `res_<name>_cvat.mp4` next to the input video')
+@click.option('--json', 'json_path', type=click.Path(exists=True, dir_okay=False), default=None,
+              help='JTA JSON of the sequence; if given, the poses are drawn too')
+@click.option('--hide/--no-hide', default=True,
+              help='if `hide` the poses of people completely occluded by objects are not drawn')
+@click.option('--start', type=int, default=None, help='first frame to render')
+@click.option('--stop', type=int, default=None, help='frame at which rendering stops (excluded)')
+@click.option('--stride', type=int, default=None, help='only one frame every `stride` frames is rendered')
+@click.option('--frames', 'frame_list', type=str, default=None,
+              help='comma-separated frame numbers to render (instead of `--start/--stop/--stride`)')
+@click.option('--max_frames', type=int, default=None, help='maximum number of (evenly spaced) frames to render')
+@click.option('--stills/--no-stills', default=False,
+              help='save the annotated frames as JPEG images in the `--out` folder instead of a video')
+@click.pass_context
+def render(ctx, mp4_path, xml_path, out_path, json_path, hide, start, stop, stride, frame_list, max_frames, stills):
+    """
+    Draw the CVAT boxes (and optionally the JTA poses) on a video;
+    with a frame selection only the selected frames are decoded (seeking through the video)
+    """
+    from utils.ann_visualization.visualize import visualize
+
+    if out_path is None:
+        name = os.path.splitext(os.path.basename(mp4_path))[0]
+        out_path = default_render_path(os.path.dirname(os.path.abspath(mp4_path)), name, stills)
+
+    frames = None
+    if frame_list is not None:
+        try:
+            frames = [int(f) for f in frame_list.split(',') if f.strip()]
+        except ValueError:
+            raise click.BadParameter(f'\'{frame_list}\' is not a list of frame numbers', param_hint='--frames')
+    elif start is not None or stop is not None or stride is not None:
+        frames = slice(start, stop, stride)
 
-    exec(open('utils/CVAT_style.py').read())
-    exec(open('utils/ann_visualization/visualize.py').read())
+    run_profiled(ctx, visualize, mp4_path, xml_path, out_path, hide=hide, json_file_path=json_path,
+                 frames=frames, max_frames=max_frames, stills=stills)
+
+
+@cli.command()
+@click.argument('seq_dir', type=click.Path(exists=True, file_okay=False))
+@click.option('--xml', 'xml_path', type=click.Path(exists=True, dir_okay=False), default=None,
+              help='CVAT XML of the sequence; default: `<seq_dir>/<seq_name>_CVAT.xml`, if any')
+@click.option('--json', 'json_path', type=click.Path(exists=True, dir_okay=False), default=None,
+              help='JTA JSON of the sequence; if given, the poses are drawn too')
+@click.option('--out', 'out_path', type=click.Path(), default=None,
+              help='path of the output video (or folder, with `--stills`); default: `res_<seq_name>_cvat`')
+@click.option('--stills/--no-stills', default=False,
+              help='save the annotated frames as JPEG images in the `--out` folder instead of a video')
+@click.option('--hide/--no-hide', default=True,
+              help='if `hide` the poses of people completely occluded by objects are not drawn')
+@click.option('--workers', type=int, default=os.cpu_count(), show_default=True, help=H_WORKERS)
+@click.pass_context
+def overlay(ctx, seq_dir, xml_path, json_path, out_path, stills, hide, workers):
+    """
+    Draw the CVAT boxes (and optionally the JTA poses) directly on the frames of a sequence folder
+    """
+    from utils.ann_visualization.overlay import overlay_frames
+
+    name = os.path.basename(os.path.normpath(seq_dir))
+    if xml_path is None and os.path.isfile(os.path.join(seq_dir, f'{name}_CVAT.xml')):
+        xml_path = os.path.join(seq_dir, f'{name}_CVAT.xml')
+    if xml_path is None and json_path is None:
+        raise click.UsageError('nothing to draw: the sequence has no CVAT XML; use `--xml` and/or `--json`')
+
+    if out_path is None:
+        out_path = default_render_path(seq_dir, name, stills)
+    run_profiled(ctx, overlay_frames, seq_dir, out_path, xml_file_path=xml_path, json_file_path=json_path,
+                 hide=hide, stills=stills, workers=workers)
+
+
+@cli.command()
+@click.argument('json_path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'formats', type=str, multiple=True,
+              help='output format (can be repeated): cvat, coco, bbox, yolo, yolo_txt, mot; default: all')
+@click.option('--out_folder', type=click.Path(file_okay=False), default=None,
+              help='folder of the outputs; default: the folder of `json_path`')
+@click.option('--verbose/--quiet', default=True, help=H_VERBOSE)
+@click.pass_context
+def export(ctx, json_path, formats, out_folder, verbose):
+    """
+    Export the JTA JSON of a sequence to many formats in a single pass
+    """
+    from utils.exporter import EXPORT_FORMATS, export_sequence, make_sinks
+
+    unknown = [f for f in formats if f not in EXPORT_FORMATS]
+    if unknown:
+        raise click.BadParameter(f'unknown format(s) {unknown}; choose among {list(EXPORT_FORMATS)}',
+                                 param_hint='--format')
+
+    sinks = make_sinks(formats or list(EXPORT_FORMATS), json_path, out_folder)
+    run_profiled(ctx, export_sequence, json_path, sinks, verbose=verbose)
+    for sink in sinks:
+        print(f'▸ {sink.name}: \'{os.path.abspath(sink.out_file_path)}\'')
+
+
+@cli.command()
+@click.argument('json_path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--width', type=int, required=True, help='width of the target frames')
+@click.option('--height', type=int, required=True, help='height of the target frames')
+@click.option('--fov', type=float, default=None,
+              help='vertical field of view [deg] of the target camera; default: the one of the sequence camera')
+@click.option('--crop', type=(int, int), default=None,
+              help='top-left corner (x, y) [px] of a `width`x`height` crop of the JTA frames, instead of a resize')
+@click.option('--out', 'out_path', type=click.Path(dir_okay=False), default=None,
+              help='path of the output JSON; default: `<seq_dir>_<width>x<height>/<seq_name>.json`')
+@click.pass_context
+def reproject(ctx, json_path, width, height, fov, crop, out_path):
+    """
+    Reproject the 3D joints of a sequence to the 2D frames of another camera (resolution, crop or field of view);
+    the camera of the sequence is derived from the `fov` column of its `coords.csv`, if any
+    """
+    from utils.geometry import FrameSize
+    from utils.projection import Intrinsics, reproject_json, sequence_intrinsics
+    from utils.sequence_cache import JTA_DTYPE, load_sequence
+
+    frame_size = FrameSize(width, height)
+    if crop is not None and fov is not None:
+        raise click.UsageError('`--crop` and `--fov` cannot be used together')
+
+    # rows of the JSON, in their order (per-row intrinsics follow it)
+    data = load_sequence(json_path, use_cache=False).reshape(-1, len(JTA_DTYPE.names))
+
+    seq_dir = os.path.dirname(os.path.abspath(json_path))
+    if fov is not None:
+        intrinsics = Intrinsics.from_fov(fov, frame_size)
+    else:
+        camera = sequence_intrinsics(seq_dir, data[:, 0])
+        if crop is not None:
+            intrinsics = camera.cropped(crop[0], crop[1], frame_size)
+        else:
+            intrinsics = camera.scaled(frame_size)
+
+    if out_path is None:
+        out_path = os.path.join(f'{seq_dir}_{width}x{height}', os.path.basename(json_path))
+
+    profiler = ctx.obj  # type: Profiler
+    with profiler, profiler.stage('reproject'):
+        out_path = reproject_json(json_path, out_path, intrinsics, data=data)
+    print(f'▸ reprojected JTA annotations: \'{os.path.abspath(out_path)}\'')
+
+
+@cli.command()
+@click.argument('json_path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--out', 'out_path', type=click.Path(dir_okay=False), default=None,
+              help='path of the output CSV; default: `<seq_name>_tracks.csv` next to the input')
+@click.pass_context
+def tracks(ctx, json_path, out_path):
+    """
+    Summarize the track of every pedestrian of a sequence (lifespan, visibility, occlusion)
+    """
+    from utils.geometry import sequence_frame_size
+    from utils.sequence_cache import load_sequence
+    from utils.track_index import TrackIndex, write_track_summary
+
+    if out_path is None:
+        out_path = os.path.splitext(json_path)[0] + '_tracks.csv'
+
+    profiler = ctx.obj  # type: Profiler
+    with profiler:
+        with profiler.stage('load'):
+            data = load_sequence(json_path)
+        with profiler.stage('index'):
+            index = TrackIndex(data, frame_size=sequence_frame_size(os.path.dirname(os.path.abspath(json_path))))
+        with profiler.stage('write'):
+            write_track_summary(index, out_path)
+    print(f'▸ {len(index)} tracks: \'{os.path.abspath(out_path)}\'')
+
+
+@cli.command()
+@click.argument('folder_data', type=click.Path(exists=True, file_okay=False))
+@click.option('--task', 'tasks', type=click.Choice(TASKS), multiple=True,
+              help='conversion to run (can be repeated); default: all')
+@click.option('--workers', type=int, default=1, show_default=True,
+              help='number of sequences converted in parallel (worker processes)')
+@click.option('--resume/--no-resume', default=True,
+              help='if `resume` only the outputs that are out of date (see the manifest of each sequence) are rebuilt')
+@click.option('--hash/--no-hash', 'hash_files', default=False,
+              help='compare the inputs also by content hash, not only by size and mtime')
+@click.option('--trace-memory/--no-trace-memory', default=False,
+              help='also measure the peak memory of every conversion with tracemalloc (slower)')
+@click.pass_context
+def pipeline(ctx, folder_data, tasks, workers, resume, hash_files, trace_memory):
+    """
+    Run the conversions (csv -> JTA JSON -> CVAT/COCO, frames -> video -> rendering)
+    on all the sequence folders of a dataset root
+    """
+    from utils.batch_convert import run_batch
+
+    profiler = ctx.obj  # type: Profiler
+    report_path = ctx.parent.params['report_path']
+
+    # per-conversion timings are collected by the jobs themselves
+    results = run_batch(folder_data, tasks=tasks or TASKS, workers=workers, resume=resume, hash_files=hash_files,
+                        report_path=report_path, profile=profiler.profile, trace_memory=trace_memory)
+
+    if any(r['status'] == 'failed' for reports in results.values() for r in reports):
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    cli()
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+# ---------------------
+
+import json
+
+import numpy as np
+
+from benchmarks.synthetic import make_sequence
+from utils.annotation_handler import csv_to_jta
+from utils.geometry import FrameSize
+from utils.projection import JTA_INTRINSICS, Intrinsics, project, reproject_json, sequence_intrinsics
+from utils.sequence_cache import load_sequence
+
+
+def test_from_fov_matches_jta_camera():
+    # the JTA camera is the GTA default camera: 50 deg vertical field of view
+    intrinsics = Intrinsics.from_fov(50)
+    assert abs(intrinsics.fx - JTA_INTRINSICS.fx) < 0.1
+    assert abs(intrinsics.fy - JTA_INTRINSICS.fy) < 0.1
+    assert abs(JTA_INTRINSICS.fov - 50) < 0.01
+
+
+def test_sequence_intrinsics_reproduce_stored_2d(tmp_path):
+    seq_dir = make_sequence(str(tmp_path), n_frames=5, n_peds=4, width=1280, height=720)
+    data = load_sequence(csv_to_jta(seq_dir), use_cache=False)
+
+    intrinsics = sequence_intrinsics(seq_dir, data[:, 0])
+    x2d, y2d = project(data[:, 5], data[:, 6], data[:, 7], intrinsics)
+    assert np.allclose(x2d, data[:, 3], atol=1e-6)
+    assert np.allclose(y2d, data[:, 4], atol=1e-6)
+
+
+def test_reproject_json_keeps_jta_layout(tmp_path):
+    seq_dir = make_sequence(str(tmp_path), n_frames=3, n_peds=2, with_frames=False)
+    json_path = csv_to_jta(seq_dir)
+    out_path = reproject_json(json_path, str(tmp_path / 'small' / 'seq_1.json'),
+                              JTA_INTRINSICS.scaled(FrameSize(960, 540)))
+
+    with open(json_path, 'r') as f:
+        rows = json.load(f)
+    with open(out_path, 'r') as f:
+        out_rows = json.load(f)
+
+    assert len(out_rows) == len(rows)
+    for row, out_row in zip(rows, out_rows):
+        # ids and 0/1 flags as integers, 3D coordinates unchanged
+        assert all(type(v) is int for v in out_row[:3] + out_row[8:])
+        assert out_row[:3] + out_row[5:] == row[:3] + row[5:]
@@ -1,19 +1,25 @@
-import json
 import os
+from concurrent.futures import ProcessPoolExecutor
 
 import numpy as np
-from utils.ann_visualization.joint import Joint
-from utils.ann_visualization.pose import Pose
-from xml.dom import minidom
+from utils.ann_visualization.pose_batch import PoseBatch
+from utils.geometry import DEFAULT_FRAME_SIZE, FrameSize, sequence_frame_size
+from utils.profiling import Profiler
+from utils.sequence_cache import load_sequence
+from utils.sequence_index import SequenceIndex, split_frames
+from xml.sax.saxutils import escape
 
 import xml.etree.ElementTree as gfg
-from xml.etree import ElementTree
 from path import Path
 
 MAX_COLORS = 42
 
-FRAME_WIDTH = 1920
-FRAME_HEIGHT = 1080
+# default frame size (see `sequence_frame_size` for the actual size of a sequence)
+FRAME_WIDTH, FRAME_HEIGHT = DEFAULT_FRAME_SIZE
+
+# padding of the pose bounding boxes (fraction of their height/width)
+BBOX_H_INC_PERC = 0.15
+BBOX_W_INC_PERC = 0.1
 
 LABEL_MAP = {
     1: "person",
@@ -27,19 +33,71 @@ LABEL_MAP = {
 
 # ["id", "name", "overlap", "bugtracker", "created", "updated", "frame_filter", "segments", "owner", "assignee"]:
 
-def prettify(elem):
-    """Return a pretty-printed XML string for the Element.
+def pretty_xml_lines(elem, level=0, indent="\t"):
+    """Yield the lines of the pretty-printed XML of the Element;
+    the layout is the same of `minidom.toprettyxml`.
+    """
+    pad = indent * level
+    attrs = "".join(' %s="%s"' % (k, escape(str(v), {'"': "&quot;"})) for k, v in elem.items())
+    children = list(elem)
+
+    if children:
+        yield f"{pad}<{elem.tag}{attrs}>\n"
+        if elem.text:
+            yield f"{pad}{indent}{escape(elem.text)}\n"
+        for child in children:
+            yield from pretty_xml_lines(child, level + 1, indent)
+        yield f"{pad}</{elem.tag}>\n"
+    elif elem.text:
+        yield f"{pad}<{elem.tag}{attrs}>{escape(elem.text)}</{elem.tag}>\n"
+    else:
+        yield f"{pad}<{elem.tag}{attrs}/>\n"
+
+
+class CVATWriter(object):
+    """
+    Incremental writer of a CVAT XML file: every node is written to disk
+    (indented) as soon as it is appended, so that memory does not grow
+    with the length of the sequence. The file is written to `<file_path>.tmp`
+    and moved to `file_path` only if the conversion completes.
     """
-    rough_string = ElementTree.tostring(elem, encoding='utf8')
-    reparsed = minidom.parseString(rough_string)
-    return reparsed.toprettyxml(indent="\t")
-
-
-def create_xml_root(name_root: str):
-    root = gfg.Element(name_root)
-    root.append(single_text_elem("version", 1.1))
 
-    return root
+    def __init__(self, file_path, name_root="annotations", indent="\t"):
+        self.file_path = file_path
+        self.name_root = name_root
+        self.indent = indent
+        self._file = None
+
+    def __enter__(self):
+        self._file = open(self.file_path + ".tmp", "w")
+        self._file.write('<?xml version="1.0" ?>\n')
+        self._file.write(f"<{self.name_root}>\n")
+        self.append(single_text_elem("version", 1.1))
+        return self
+
+    def append(self, elem):
+        """Write the Element as a child of the root node.
+        """
+        self._file.writelines(pretty_xml_lines(elem, level=1, indent=self.indent))
+
+    def append_raw(self, text):
+        """Write already serialized child nodes of the root node (see `pretty_xml_lines`).
+        """
+        self._file.write(text)
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        try:
+            if exc_type is None:
+                self._file.write(f"</{self.name_root}>\n")
+        finally:
+            self._file.close()
+            self._file = None
+
+        # a partial file is never left at `file_path`
+        if exc_type is None:
+            os.replace(self.file_path + ".tmp", self.file_path)
+        else:
+            os.remove(self.file_path + ".tmp")
 
 
 def single_text_elem(name_elem, text):
@@ -100,81 +158,165 @@ def get_box_node(label: str, xtl: int, ytl: int, xbr: int, ybr: int, occluded=0)
     return box_node
 
 
-def get_pose(frame_data, person_id):
-    # type: (np.ndarray, int) -> Pose
-    """
-    :param frame_data: data of the current frame
-    :param person_id: person identifier
-    :return: list of joints in the current frame with the required person ID
-    """
-    pose = [Joint(j) for j in frame_data[frame_data[:, 1] == person_id]]
-    pose.sort(key=(lambda j: j.type))
-    return Pose(pose)
-
-
-def normalize_bbox(x, y):
+def normalize_bbox(x, y, frame_size=DEFAULT_FRAME_SIZE):
     if x < 0:
         x = 0
     if y < 0:
         y = 0
 
-    if x > FRAME_WIDTH:
-        x = FRAME_WIDTH
+    if x > frame_size.width:
+        x = frame_size.width
 
-    if y > FRAME_HEIGHT:
-        y = FRAME_HEIGHT
+    if y > frame_size.height:
+        y = frame_size.height
 
     return x, y
 
 
-def json_imavis_style_conversion(json_file_path, out_folder):
+def normalize_bboxes(boxes, frame_size=DEFAULT_FRAME_SIZE):
+    # type: (np.ndarray, FrameSize) -> np.ndarray
+    """
+    :param boxes: (n, 4) array of boxes in format [x_min, y_min, x_max, y_max]
+    :param frame_size: size of the frame
+    :return: boxes clipped to the frame, as `normalize_bbox` does for each corner
+    """
+    return frame_size.clip_boxes(boxes)
+
+
+def get_boxes_image_node(frame_number, boxes, frame_size=DEFAULT_FRAME_SIZE):
+    # type: (int, np.ndarray, FrameSize) -> gfg.Element
+    """
+    :param frame_number: frame number
+    :param boxes: (n, 4) array of person boxes in format [x_min, y_min, x_max, y_max]
+    :param frame_size: size of the frame
+    :return: <image> node of the frame, with a box for each row of `boxes` (clipped to the frame)
+    """
+    image_node = get_image_node(id_frame=frame_number,
+                                frame_name=f"{frame_number}.jpg",
+                                frame_width=frame_size.width,
+                                frame_height=frame_size.height)
+
+    clipped = normalize_bboxes(boxes, frame_size)
+
+    # clipped corners are written as integers (e.g. "0", "1920"), as `normalize_bbox` does
+    is_clipped = (clipped != boxes).tolist()
+
+    for values, flags in zip(clipped.tolist(), is_clipped):
+        xtl, ytl, xbr, ybr = [int(v) if f else v for v, f in zip(values, flags)]
+        image_node.append(get_box_node(LABEL_MAP[1], xtl, ytl, xbr, ybr))
+
+    return image_node
+
+
+def get_frame_image_node(frame_number, poses):
+    # type: (int, PoseBatch) -> gfg.Element
+    """
+    :param frame_number: frame number
+    :param poses: all the poses of the frame
+    :return: <image> node of the frame, with a box for each pose that is visible enough
+    """
+    poses.handle_joints_not_on_screen()
+
+    keep = ~(poses.head_not_visible | poses.half_not_visible | poses.invisible)
+
+    boxes = poses.bbox_2d_padded(BBOX_H_INC_PERC, BBOX_W_INC_PERC)[keep]
+    return get_boxes_image_node(frame_number, boxes, poses.frame_size)
+
+
+def image_nodes_chunk(json_file_path, first_frame, stop_frame, row_start, row_stop, frame_size=DEFAULT_FRAME_SIZE):
+    """
+    Worker of `json_imavis_style_conversion`: the sequence is read from its
+    memory-mapped cache (not pickled) and only rows [row_start, row_stop) are used.
+
+    :return: serialized <image> nodes of the frames in [first_frame, stop_frame)
+    """
+    index = SequenceIndex(load_sequence(json_file_path)[row_start:row_stop], frame_size=frame_size)
+
+    lines = []
+    for frame_number in range(first_frame, stop_frame):
+        lines.extend(pretty_xml_lines(get_frame_image_node(frame_number, index.poses(frame_number)), level=1))
+
+    return "".join(lines)
+
+
+def json_imavis_style_conversion(json_file_path, out_folder, verbose=True, workers=1, profiler=None,
+                                 frame_size=None):
     """
     Script that provides a visual representation of the annotations
+
+    :param json_file_path: path of the JTA JSON of the sequence (e.g. `seq_3.json`)
+    :param out_folder: folder of the output CVAT XML
+    :param verbose: if True, the conversion progress is printed
+    :param workers: number of worker processes; if > 1, ranges of frames are converted
+        in parallel and their <image> nodes are written in frame order
+    :param profiler: if given, the time spent in each stage (load, group, pose, filter,
+        serialize, write) is recorded in it; with `workers` > 1, pose, filter and serialize
+        run in the workers and are recorded as a single 'convert' stage
+    :param frame_size: size of the frames; default: read from the frames (or the video)
+        in the folder of `json_file_path` (see `sequence_frame_size`)
+    :return: path of the output CVAT XML
     """
+    profiler = Profiler('cvat') if profiler is None else profiler
+
+    if frame_size is None:
+        frame_size = sequence_frame_size(os.path.dirname(os.path.abspath(json_file_path)))
 
-    with open(json_file_path, 'r') as json_file:
-        data = json.load(json_file)
-        data = np.array(data)
+    with profiler.stage('load'):
+        data = load_sequence(json_file_path)
 
     n_seq = json_file_path.split(os.sep)[-1].split(".")[0].split("_")[1]
 
-    n_frames = int(data[-1][0]) + 1
+    with profiler.stage('group'):
+        index = SequenceIndex(data, frame_size=frame_size)
+    n_frames = index.n_frames
 
-    xml_root = create_xml_root("annotations")
-    xml_root.append(create_meta_xml(n_frames))
+    out_file_path = os.path.join(out_folder, f"seq_{n_seq}_CVAT.xml")
 
-    for frame_number in range(n_frames):
+    with CVATWriter(out_file_path) as writer:
+        writer.append(create_meta_xml(n_frames))
 
-        # Get all the data for a given frame
-        frame_data = data[data[:, 0] == frame_number]  # type: np.ndarray
+        if workers > 1:
+            chunks = split_frames(0, n_frames, n_chunks=4 * workers)
 
-        image_node = get_image_node(id_frame=frame_number,
-                                    frame_name=f"{frame_number}.jpg",
-                                    frame_width=FRAME_WIDTH,
-                                    frame_height=FRAME_HEIGHT)
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = [pool.submit(image_nodes_chunk, json_file_path, first_frame, stop_frame,
+                                       *index.rows(first_frame, stop_frame), frame_size)
+                           for first_frame, stop_frame in chunks]
 
-        for p_id in set(frame_data[:, 1]):
+                for (first_frame, stop_frame), future in zip(chunks, futures):
+                    with profiler.stage('convert'):
+                        text = future.result()
+                    with profiler.stage('write'):
+                        writer.append_raw(text)
+                    profiler.count('frames', stop_frame - first_frame)
+                    if verbose:
+                        print(f'\r▸"Annotation seq_{n_seq} progress: {100 * (stop_frame / n_frames):6.2f}%', end='')
 
-            pose = get_pose(frame_data=frame_data, person_id=p_id)
-            pose.handle_joints_not_on_screen()
+        else:
+            for frame_number in range(n_frames):
 
-            if pose.head_not_visible or pose.half_not_visible or pose.invisible:
-                continue
+                # Get all the data for a given frame
+                frame_data = index.frame(frame_number)  # type: np.ndarray
 
-            xtl, ytl, xbr, ybr = pose.bbox_2d_padded
+                with profiler.stage('pose'):
+                    poses = PoseBatch(frame_data, presorted=True, frame_size=frame_size)
 
-            xtl, ytl = normalize_bbox(xtl, ytl)
-            xbr, ybr = normalize_bbox(xbr, ybr)
+                with profiler.stage('filter'):
+                    image_node = get_frame_image_node(frame_number, poses)
 
-            image_node.append(get_box_node(LABEL_MAP[1], xtl, ytl, xbr, ybr))
+                with profiler.stage('serialize'):
+                    text = "".join(pretty_xml_lines(image_node, level=1))
 
-        xml_root.append(image_node)
-        print(f'\r▸"Annotation seq_{n_seq} progress: {100 * (frame_number / (n_frames - 1)):6.2f}%', end='')
+                with profiler.stage('write'):
+                    writer.append_raw(text)
 
-    xml_str = prettify(xml_root)
+                profiler.count('frames')
+                profiler.count('boxes', len(image_node))
+                if verbose:
+                    print(f'\r▸"Annotation seq_{n_seq} progress: {100 * (frame_number / (n_frames - 1)):6.2f}%',
+                          end='')
 
-    with open(os.path.join(out_folder, f"seq_{n_seq}_CVAT.xml"), "w") as f:
-        f.write(xml_str)
+    return out_file_path
 
 
 if __name__ == "__main__":
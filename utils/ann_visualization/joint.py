@@ -6,6 +6,8 @@ from typing import *
 import cv2
 import numpy as np
 
+from utils.geometry import DEFAULT_FRAME_SIZE, FrameSize
+
 
 class Joint(object):
     """
@@ -38,11 +40,13 @@ class Joint(object):
         'left_ankle',
     ]
 
-    def __init__(self, array):
-        # type: (np.ndarray) -> None
+    def __init__(self, array, frame_size=DEFAULT_FRAME_SIZE):
+        # type: (np.ndarray, FrameSize) -> None
         """
         :param array: array version of the joint
+        :param frame_size: size of the frame the joint belongs to
 		"""
+        self.frame_size = frame_size
 
         self.frame = int(array[0])
         self.person_id = int(array[1])
@@ -70,7 +74,7 @@ class Joint(object):
         """
 		:return: True if the joint is on screen, False otherwise
 		"""
-        return (0 <= self.x2d <= 1920) and (0 <= self.y2d <= 1080)
+        return bool(self.frame_size.on_screen(self.x2d, self.y2d))
 
     @property
     def visible(self):
@@ -120,7 +124,7 @@ class Joint(object):
 		:return: appropriate radius [px] for the circle that represents the joint;
 		this radius is a function of the distance of the joint from the camera
 		"""
-        radius = int(round(np.power(10, 1 - (self.cam_distance / 20.0))))
+        radius = int(round(10 ** (1 - (self.cam_distance / 20.0))))
         return radius if radius >= 1 else 1
 
     @property
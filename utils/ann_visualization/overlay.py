@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+# ---------------------
+
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor
+from contextlib import ExitStack
+from typing import *
+
+import cv2
+import numpy as np
+from path import Path
+
+from utils.ann_visualization.pose_batch import PoseBatch
+from utils.ann_visualization.utils_imavis import DetectionTable, iter_cvat_tables
+from utils.ann_visualization.visualize import MAX_COLORS, draw_frame, get_colors
+from utils.frames_seq_to_video import get_file_folder_list, sort_by_filename_number
+from utils.geometry import FrameSize, sequence_frame_size
+from utils.profiling import Profiler
+from utils.sequence_cache import load_sequence
+from utils.sequence_index import SequenceIndex
+
+
+def map_ordered(pool, fn, jobs, prefetch=16):
+    # type: (Executor, Callable, Iterable[tuple], int) -> Iterator[Any]
+    """
+    :param pool: pool of workers
+    :param fn: function to call on the arguments of each job
+    :param jobs: arguments of the jobs
+    :param prefetch: maximum number of jobs submitted (and not consumed) at the same time
+    :return: iterator over the results of the jobs, in the order of `jobs`
+    """
+    pending = deque()
+    for args in jobs:
+        pending.append(pool.submit(fn, *args))
+        if len(pending) >= prefetch:
+            yield pending.popleft().result()
+
+    while pending:
+        yield pending.popleft().result()
+
+
+def overlay_frame(frame_path, detections, frame_data, frame_size, colors, hide, out_path=None):
+    # type: (str, DetectionTable, Optional[np.ndarray], FrameSize, List[List[int]], bool, Optional[str]) -> Any
+    """
+    Worker of `overlay_frames`: read a frame, draw its annotations (see `draw_frame`)
+    and, if `out_path` is given, save it
+
+    :param frame_path: path of the frame
+    :param detections: CVAT boxes of the frame
+    :param frame_data: JTA rows of the frame (or None)
+    :param frame_size: size of the frames
+    :param colors: color map (BGR)
+    :param hide: if True, completely occluded poses are not drawn
+    :param out_path: if given, the annotated frame is saved here (and not returned)
+    :return: annotated frame (BGR), or None if it has been saved
+    """
+    image = cv2.imread(frame_path)
+    poses = None if frame_data is None else PoseBatch(frame_data, presorted=True, frame_size=frame_size)
+    image = draw_frame(image, detections, poses, colors, hide)
+
+    if out_path is not None:
+        cv2.imwrite(out_path, image)
+        return None
+    return image
+
+
+def overlay_frames(seq_dir, out_path, xml_file_path=None, json_file_path=None, hide=True, stills=False, workers=4,
+                   prefetch=16, fps_video=20, profiler=None):
+    """
+    Draw the CVAT boxes and/or the JTA poses directly on the numbered frames of a
+    sequence folder (see `get_file_folder_list`), without encoding them into a video
+    and decoding it again (see `visualize`).
+    Frames are read, drawn (and, for stills, saved) by a pool of worker processes;
+    results are reassembled in frame order, with at most `prefetch` frames in flight.
+
+    :param seq_dir: sequence folder containing the frames
+    :param out_path: path of the output video, or output folder if `stills` is True
+    :param xml_file_path: CVAT XML of the sequence; if given, the boxes are drawn
+    :param json_file_path: JTA JSON of the sequence; if given, the poses are drawn
+    :param hide: if True, the poses of people completely occluded by objects are not drawn
+    :param stills: if True, every annotated frame is saved as `<out_path>/<frame_number>.jpg`
+    :param workers: number of worker processes; if 1, frames are drawn in the calling process
+    :param prefetch: maximum number of frames in flight
+    :param fps_video: frame rate of the output video
+    :param profiler: if given, the time spent in each stage (list, load, parse, render, encode)
+        is recorded in it; 'render' is the time spent waiting for the workers
+    :return: path of the output video (or folder)
+    """
+    profiler = Profiler('overlay') if profiler is None else profiler
+
+    out_path = Path(out_path)
+    out_dir = out_path if stills else out_path.parent
+    if not out_dir.exists() and out_dir != Path(''):
+        out_dir.makedirs()
+
+    with profiler.stage('list'):
+        paths = get_file_folder_list(seq_dir)
+        frame_numbers = [sort_by_filename_number(p) for p in paths]
+
+    frame_size = sequence_frame_size(seq_dir)
+
+    index = None
+    if json_file_path is not None:
+        with profiler.stage('load'):
+            index = SequenceIndex(load_sequence(json_file_path), frame_size=frame_size)
+
+    detections = {}
+    if xml_file_path is not None:
+        with profiler.stage('parse'):
+            detections = dict(iter_cvat_tables(Path(xml_file_path), frames=frame_numbers))
+
+    # frames are read (and written) by OpenCV, in BGR
+    colors = [c[::-1] for c in get_colors(number_of_colors=MAX_COLORS, cmap_name='jet')]
+    no_detections = DetectionTable.empty()
+
+    out_video = None
+    if not stills:
+        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+        out_video = cv2.VideoWriter(str(out_path), fourcc, fps_video, (frame_size.width, frame_size.height))
+
+    # (arguments of `overlay_frame`) for each frame, in order
+    jobs = ((frame_path, detections.get(frame_number, no_detections),
+             index.frame(frame_number) if index is not None else None, frame_size, colors, hide,
+             str(out_path / f'{frame_number}.jpg') if stills else None)
+            for frame_number, frame_path in zip(frame_numbers, paths))
+
+    print(f'▸ drawing annotations on the frames of \'{Path(seq_dir).abspath()}\'')
+    try:
+        with ExitStack() as stack:
+            if workers > 1:
+                pool = stack.enter_context(ProcessPoolExecutor(max_workers=workers))
+                results = map_ordered(pool, overlay_frame, jobs, prefetch)
+            else:
+                results = (overlay_frame(*job) for job in jobs)
+
+            for n_done in range(1, len(paths) + 1):
+                with profiler.stage('render'):
+                    image = next(results)
+                if out_video is not None:
+                    with profiler.stage('encode'):
+                        out_video.write(image)
+
+                profiler.count('frames')
+                print(f'\r▸ progress: {100 * (n_done / len(paths)):6.2f}%', end='')
+    finally:
+        if out_video is not None:
+            out_video.release()
+
+    print(f'\n▸ annotated frames: \'{out_path.abspath()}\'\n')
+    return out_path
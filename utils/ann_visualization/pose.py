@@ -7,6 +7,7 @@ import cv2
 import numpy as np
 
 from utils.ann_visualization.joint import Joint
+from utils.geometry import DEFAULT_FRAME_SIZE
 
 import math
 
@@ -162,20 +163,80 @@ class Pose(list):
 		:param color: color of the limbs make up the pose
 		:return: image with the pose
 		"""
-        # draw limb(s) segments
-        for (j_id_a, j_id_b) in Pose.LIMBS:
-            joint_a = self[j_id_a]  # type: Joint
-            joint_b = self[j_id_b]  # type: Joint
-            t = 1 if joint_a.cam_distance > 25 else 2
-            if joint_a.is_on_screen and joint_b.is_on_screen:
-                cv2.line(image, joint_a.pos2d, joint_b.pos2d, color=color, thickness=t)
-
-        # draw joint(s) circles
-        for joint in self:
-            image = joint.draw(image)
+        pos2d = np.array([j.pos2d for j in self], dtype=np.int64).reshape(-1, 2)
+        cam_distance = np.array([j.cam_distance for j in self], dtype=np.float64)
+        occ = np.array([j.occ for j in self], dtype=bool)
+        soc = np.array([j.soc for j in self], dtype=bool)
+        on_screen = np.array([j.is_on_screen for j in self], dtype=bool)
 
-        return image
+        return draw_poses(image, pos2d, cam_distance, occ, soc,
+                          starts=np.array([0]), counts=np.array([len(self)]), colors=[color], on_screen=on_screen)
 
     def __iter__(self):
         # type: () -> Iterator[Joint]
         return super().__iter__()
+
+
+# joint colors (see `Joint.color`): visible, self-occluded, occluded
+JOINT_COLORS = np.array([
+    (0, 255, 42),  # green
+    (255, 128, 42),  # orange
+    (255, 0, 42),  # red
+])
+
+
+def draw_poses(image, pos2d, cam_distance, occ, soc, starts, counts, colors, on_screen=None):
+    # type: (np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray, List[List[int]], Optional[np.ndarray]) -> np.ndarray
+    """
+    Draw many poses at once; the result is the same as calling `Pose.draw` on each pose.
+    Limb endpoints, thicknesses, radii and colors are computed with NumPy, then each pose
+    is drawn with (at most) one `cv2.polylines` call per limb thickness, followed by its joints.
+
+    :param image: image on which to draw the poses
+    :param pos2d: (n_joints, 2) 2D coordinates of the joints [px]
+    :param cam_distance: (n_joints,) distance of the joints from the camera
+    :param occ: (n_joints,) occluded flags
+    :param soc: (n_joints,) self-occluded flags
+    :param starts: index of the first joint of each pose (joints of a pose are sorted by type)
+    :param counts: number of joints of each pose
+    :param colors: limb color of each pose
+    :param on_screen: (n_joints,) on-screen flags; default: inside a frame of `DEFAULT_FRAME_SIZE`
+    :return: image with the poses
+    """
+    if len(starts) == 0:
+        return image
+
+    pos2d = np.asarray(pos2d, dtype=np.int64)
+    if on_screen is None:
+        on_screen = DEFAULT_FRAME_SIZE.on_screen(pos2d[:, 0], pos2d[:, 1])
+
+    # joint radius is a function of the distance from the camera (see `Joint.radius`)
+    radius = np.maximum(np.round(np.power(10, 1 - (cam_distance / 20.0))), 1).astype(np.int64)
+    joint_colors = JOINT_COLORS[np.where(occ, 2, np.where(soc, 1, 0))]
+
+    # limbs of every pose: (n_poses, n_limbs) joint indices
+    limbs = np.array(Pose.LIMBS)
+    valid = (limbs[:, 0] < counts[:, None]) & (limbs[:, 1] < counts[:, None])
+    last = max(len(pos2d) - 1, 0)
+    idx_a = np.minimum(starts[:, None] + limbs[:, 0], last)
+    idx_b = np.minimum(starts[:, None] + limbs[:, 1], last)
+    valid &= on_screen[idx_a] & on_screen[idx_b]
+    thickness = np.where(cam_distance[idx_a] > 25, 1, 2)
+    segments = np.stack([pos2d[idx_a], pos2d[idx_b]], axis=2).astype(np.int32)
+
+    centers = pos2d.tolist()
+    radius = radius.tolist()
+    joint_colors = joint_colors.tolist()
+
+    for i, (start, count) in enumerate(zip(starts.tolist(), counts.tolist())):
+        # draw limb(s) segments
+        for t in (1, 2):
+            selected = valid[i] & (thickness[i] == t)
+            if selected.any():
+                cv2.polylines(image, list(segments[i][selected]), False, color=colors[i], thickness=t)
+
+        # draw joint(s) circles
+        for j in range(start, start + count):
+            image = cv2.circle(image, thickness=-1, center=tuple(centers[j]), radius=radius[j], color=joint_colors[j])
+
+    return image
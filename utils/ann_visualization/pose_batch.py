@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+# ---------------------
+
+from typing import *
+
+import numpy as np
+
+from utils.ann_visualization.joint import Joint
+from utils.ann_visualization.pose import Pose, draw_poses
+from utils.geometry import DEFAULT_FRAME_SIZE, FrameSize
+from utils.sequence_cache import jta_columns
+
+
+class PoseBatch(object):
+    """
+    a PoseBatch is a columnar collection of Pose(s): one array per joint field,
+    covering all the people of a frame (or of a whole sequence).
+    Every pose-level attribute is computed for all the poses at once.
+    """
+
+    # joint types of the head: head_top, head_center, neck
+    HEAD_JOINTS = (0, 1, 2)
+
+    def __init__(self, data, presorted=False, frame_size=DEFAULT_FRAME_SIZE):
+        # type: (np.ndarray, bool, FrameSize) -> None
+        """
+        :param data: JTA array with one row per joint (or `JTA_DTYPE` records); columns are
+            (frame, person_id, type, x2d, y2d, x3d, y3d, z3d, occ, soc)
+        :param presorted: True if `data` is already sorted by (frame, person_id, type)
+        :param frame_size: size of the frame(s) of the poses
+        """
+        self.frame_size = frame_size
+
+        data = np.asarray(data)
+        if data.dtype.names is None and data.ndim != 2:
+            data = data.reshape(-1, 10)
+
+        if not presorted:
+            # stable: joints with the same key keep their original order
+            frame, person_id, j_type = jta_columns(data)[:3]
+            data = data[np.lexsort((j_type, person_id, frame))]
+
+        columns = jta_columns(data)
+
+        self.data = data
+        self.frame = columns[0].astype(np.int64)
+        self.person_id = columns[1].astype(np.int64)
+        self.type = columns[2].astype(np.int64)
+        self.x2d = columns[3].astype(np.int64)
+        self.y2d = columns[4].astype(np.int64)
+        self.x3d = columns[5].astype(np.float64)
+        self.y3d = columns[6].astype(np.float64)
+        self.z3d = columns[7].astype(np.float64)
+        self.occ = columns[8].astype(bool)  # is this joint occluded?
+        self.soc = columns[9].astype(bool)  # is this joint self-occluded?
+
+        frame, person_id = self.frame, self.person_id
+
+        # a new pose starts wherever (frame, person_id) changes
+        n = len(data)
+        new_pose = np.ones(n, dtype=bool)
+        new_pose[1:] = (frame[1:] != frame[:-1]) | (person_id[1:] != person_id[:-1])
+        self.starts = np.flatnonzero(new_pose)
+        self.counts = np.diff(np.append(self.starts, n))
+
+    def __len__(self):
+        # type: () -> int
+        return len(self.starts)
+
+    def __iter__(self):
+        # type: () -> Iterator[Pose]
+        for i in range(len(self)):
+            yield self.pose(i)
+
+    def _reduce(self, ufunc, values):
+        # type: (np.ufunc, np.ndarray) -> np.ndarray
+        """
+        :param ufunc: binary ufunc used to reduce the joints of each pose (e.g. `np.minimum`)
+        :param values: per-joint values
+        :return: per-pose reduced values
+        """
+        if len(self) == 0:
+            return np.zeros(0, dtype=values.dtype)
+        return ufunc.reduceat(values, self.starts)
+
+    @property
+    def frames(self):
+        # type: () -> np.ndarray
+        """
+        :return: frame number of each pose
+        """
+        return self.frame[self.starts]
+
+    @property
+    def person_ids(self):
+        # type: () -> np.ndarray
+        """
+        :return: person identifier of each pose
+        """
+        return self.person_id[self.starts]
+
+    @property
+    def cam_distance(self):
+        # type: () -> np.ndarray
+        """
+        :return: distance of each joint from the camera
+        """
+        # NOTE: camera coords = (0, 0, 0)
+        return np.sqrt(self.x3d ** 2 + self.y3d ** 2 + self.z3d ** 2)
+
+    @property
+    def on_screen(self):
+        # type: () -> np.ndarray
+        """
+        :return: per-joint mask, True if the joint is on screen
+        """
+        return self.frame_size.on_screen(self.x2d, self.y2d)
+
+    @property
+    def n_occluded(self):
+        # type: () -> np.ndarray
+        """
+        :return: number of occluded joints of each pose
+        """
+        return self._reduce(np.add, self.occ.astype(np.int64))
+
+    @property
+    def invisible(self):
+        # type: () -> np.ndarray
+        """
+        :return: per-pose mask, True if all the joints of the pose are occluded
+        """
+        return self.n_occluded == self.counts
+
+    @property
+    def head_not_visible(self):
+        # type: () -> np.ndarray
+        """
+        :return: per-pose mask, True if all the head joints of the pose are occluded
+        """
+        visible_head = np.isin(self.type, PoseBatch.HEAD_JOINTS) & ~self.occ
+        return self._reduce(np.add, visible_head.astype(np.int64)) == 0
+
+    @property
+    def half_not_visible(self):
+        # type: () -> np.ndarray
+        """
+        :return: per-pose mask, True if at least half of the joints of the pose are occluded
+        """
+        return self.n_occluded >= (self.counts // 2)
+
+    @property
+    def bbox_2d(self):
+        # type: () -> np.ndarray
+        """
+        :return: (n_poses, 4) array of bounding boxes in format [x_min, y_min, x_max, y_max]
+        """
+        return np.stack([
+            self._reduce(np.minimum, self.x2d),
+            self._reduce(np.minimum, self.y2d),
+            self._reduce(np.maximum, self.x2d),
+            self._reduce(np.maximum, self.y2d),
+        ], axis=1)
+
+    def bbox_2d_padded(self, h_inc_perc=0.15, w_inc_perc=0.1):
+        # type: (float, float) -> np.ndarray
+        """
+        :param h_inc_perc: height increment (fraction of the bbox height)
+        :param w_inc_perc: width increment (fraction of the bbox width)
+        :return: (n_poses, 4) array of padded bounding boxes in format [x_min, y_min, x_max, y_max]
+        """
+        x_min, y_min, x_max, y_max = self.bbox_2d.T
+        inc_w = ((x_max - x_min) * w_inc_perc) / 2
+        inc_h = ((y_max - y_min) * h_inc_perc) / 2
+        return np.stack([x_min - inc_w, y_min - inc_h, x_max + inc_w, y_max + inc_h], axis=1)
+
+    def handle_joints_not_on_screen(self):
+        # type: () -> None
+        """
+        mark as occluded all the joints that are not on screen
+        """
+        self.occ |= ~self.on_screen
+
+    def coco_annotations(self, mask=None):
+        # type: (Optional[np.ndarray]) -> List[Dict]
+        """
+        :param mask: optional per-pose mask of the poses to convert
+        :return: COCO annotation dictionaries of the (selected) poses;
+            see `Pose.coco_annotation`
+        """
+        keypoints = np.stack([self.x2d, self.y2d, np.full_like(self.x2d, 2)], axis=1)
+        bboxes = self.bbox_2d.tolist()
+        indices = range(len(self)) if mask is None else np.flatnonzero(mask)
+
+        annotations = []
+        for i in indices:
+            start, count = self.starts[i], self.counts[i]
+            annotations.append({
+                'keypoints': keypoints[start:start + count].ravel().tolist(),
+                'num_keypoints': int(count),
+                'bbox': bboxes[i]
+            })
+        return annotations
+
+    def pose(self, i):
+        # type: (int) -> Pose
+        """
+        :param i: index of the pose in the batch
+        :return: the i-th pose as a list of Joint(s), for drawing and backwards compatibility
+        """
+        start, stop = self.starts[i], self.starts[i] + self.counts[i]
+        joints = []
+        for row, occ in zip(self.data[start:stop], self.occ[start:stop]):
+            joint = Joint(row, self.frame_size)
+            joint.occ = bool(occ)
+            joints.append(joint)
+        return Pose(joints)
+
+    def draw(self, image, colors, mask=None):
+        # type: (np.ndarray, List[List[int]], Optional[np.ndarray]) -> np.ndarray
+        """
+        :param image: image on which to draw the poses
+        :param colors: limb color of each pose
+        :param mask: optional per-pose mask of the poses to draw
+        :return: image with the poses; same result as `Pose.draw` on each pose
+        """
+        starts, counts = self.starts, self.counts
+        if mask is not None:
+            starts, counts = starts[mask], counts[mask]
+            colors = [c for c, m in zip(colors, mask) if m]
+
+        pos2d = np.stack([self.x2d, self.y2d], axis=1)
+        return draw_poses(image, pos2d, self.cam_distance, self.occ, self.soc, starts, counts, colors,
+                          on_screen=self.on_screen)
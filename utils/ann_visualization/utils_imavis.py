@@ -1,7 +1,8 @@
 import codecs
-from typing import Tuple, List
+from typing import Collection, Dict, Iterator, List, Optional, Sequence, Tuple, Union
 from venv import logger
 
+import numpy as np
 from xml.etree import ElementTree as ET
 from path import Path
 
@@ -14,72 +15,302 @@ LABEL_MAP = dict(
     bicycle=6,
 )
 
+# labels accepted in input and the LABEL_MAP label they are mapped to
+LABEL_ALIASES = dict(
+    cat="dog",
+    bus="truck",
+    motorbike="motorcycle",
+)
+
+
+# LABEL_MAP label of each label id
+LABEL_NAMES = {label_id: label for label, label_id in LABEL_MAP.items()}
+
+
+def label_ids(labels: Sequence[str]) -> np.ndarray:
+    """
+    :param labels: CVAT labels of the boxes (aliases, see `LABEL_ALIASES`, are accepted)
+    :return: LABEL_MAP id of each label; -1 for unknown labels.
+        Every distinct label is looked up only once.
+    """
+    if len(labels) == 0:
+        return np.zeros(0, dtype=np.int64)
+    names, inverse = np.unique(np.asarray(labels, dtype=str), return_inverse=True)
+    ids = np.array([LABEL_MAP.get(LABEL_ALIASES.get(n, n), -1) for n in names.tolist()], dtype=np.int64)
+    return ids[inverse.ravel()]
+
+
+def validate_boxes(points: np.ndarray, frame_width: np.ndarray, frame_height: np.ndarray) -> Dict[str, np.ndarray]:
+    """
+    :param points: (n, 4) boxes in format [xtl, ytl, xbr, ybr]
+    :param frame_width: width of the image of each box (or a single width)
+    :param frame_height: height of the image of each box (or a single height)
+    :return: one per-box mask for each kind of violation
+    """
+    xtl, ytl, xbr, ybr = points.T
+    return {
+        "negative coordinates": (points < 0).any(axis=1),
+        "outside of the image": (np.maximum(xtl, xbr) > frame_width) | (np.maximum(ytl, ybr) > frame_height),
+        "inverted corners": (xbr < xtl) | (ybr < ytl),
+    }
+
+
+def report_violations(xml_path: Path, counts: Dict[str, int]) -> None:
+    """
+    Log a single summary line with the number of boxes of each kind of violation
+    """
+    if any(counts.values()):
+        summary = ", ".join(f"{n} with {k}" for k, n in counts.items() if n > 0)
+        logger.warning(f"task {str(xml_path)} has not valid bounding boxes: {summary}")
+
 
 class Detection(object):
-    _tl_x: float
-    _tl_y: float
-    _br_x: float
-    _br_y: float
-    _centroid_x: float
-    _centroid_y: float
-    _label: str
-    _invisible: bool
-    _occluded: bool
-
-    def __init__(self, tl_x: float, tl_y: float, br_x: float, br_y: float, label: str, invisible: bool, occluded: bool):
-        assert 0 <= tl_x, tl_x
-        assert 0 <= tl_y, tl_y
-        assert 0 <= br_x, br_x
-        assert 0 <= br_y, br_y
-        self._centroid_x = ((tl_x + br_x) / 2.)
-        self._centroid_y = ((tl_y + br_y) / 2.)
-        self._tl_x = tl_x
-        self._tl_y = tl_y
-        self._br_x = br_x
-        self._br_y = br_y
-        width = self._br_x - self._tl_x
-        height = self._br_y - self._tl_y
-        assert width >= 0, width
-        assert height >= 0, height
-
-        try:
-            assert width * height >= 0, width * height
-        except:
-            print("width * height: ", width * height)
-            print(self._tl_x, self._tl_y, self._br_x, self._br_y)
-            exit()
-
-        if label == "cat" and "cat" not in LABEL_MAP:
-            label = "dog"
-        if label == "bus":
-            label = "truck"
-        if label == "motorbike":
-            label = "motorcycle"
-        assert label in LABEL_MAP
-        self._label = label
-        self._invisible = invisible
-        self._occluded = occluded
+    """
+    a Detection is a lightweight view of a box of a DetectionTable
+    """
+
+    __slots__ = ("table", "index")
+
+    def __init__(self, table: "DetectionTable", index: int):
+        self.table = table
+        self.index = index
 
     def is_occluded(self) -> bool:
-        return self._occluded
+        return bool(self.table.occluded[self.index])
 
     def is_invisible(self) -> bool:
-        return self._invisible
+        # "outside" boxes are not exported to CVAT
+        return False
 
     def get_centroid(self) -> Tuple[float, float]:
-        return self._centroid_x, self._centroid_y
+        xtl, ytl, xbr, ybr = self.points
+        return (xtl + xbr) / 2., (ytl + ybr) / 2.
 
     @property
     def points(self) -> Tuple[float, float, float, float]:
-        return self._tl_x, self._tl_y, self._br_x, self._br_y
+        return tuple(self.table.points[self.index].tolist())
 
     @property
     def label(self) -> str:
-        return self._label
+        return LABEL_NAMES[self.label_id]
 
     @property
     def label_id(self) -> int:
-        return LABEL_MAP[self._label]
+        return int(self.table.label_id[self.index])
+
+    def __repr__(self):
+        return f"Detection({self.label}, {self.points}, occluded={self.is_occluded()})"
+
+
+class DetectionTable(object):
+    """
+    a DetectionTable stores the CVAT boxes of a task (or of a frame) in contiguous
+    arrays sorted by frame: frame, label_id, points (xtl, ytl, xbr, ybr) and occluded;
+    the boxes of a frame are a zero-copy view of the table.
+    """
+
+    def __init__(self, frame: np.ndarray, label_id: np.ndarray, points: np.ndarray, occluded: np.ndarray,
+                 frame_count: Optional[int] = None):
+        """
+        :param frame: frame of each box
+        :param label_id: LABEL_MAP id of each box
+        :param points: (n, 4) boxes in format [xtl, ytl, xbr, ybr]
+        :param occluded: occluded flag of each box
+        :param frame_count: number of frames of the task; default: last frame + 1
+        """
+        frame = np.asarray(frame, dtype=np.int64)
+        label_id = np.asarray(label_id, dtype=np.int64)
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 4)
+        occluded = np.asarray(occluded, dtype=bool)
+
+        if len(frame) > 1 and (np.diff(frame) < 0).any():
+            order = np.argsort(frame, kind="stable")
+            frame, label_id, points, occluded = frame[order], label_id[order], points[order], occluded[order]
+
+        self.frame = frame
+        self.label_id = label_id
+        self.points = points
+        self.occluded = occluded
+        self.frame_count = frame_count if frame_count is not None else (int(frame[-1]) + 1 if len(frame) else 0)
+
+        # number of boxes that are not valid, and of each kind of violation (see `from_raw`)
+        self.n_invalid = 0
+        self.violations = {}  # type: Dict[str, int]
+
+        self.frame_ids, self._starts = np.unique(frame, return_index=True)
+        self._stops = np.append(self._starts[1:], len(frame))
+
+    @staticmethod
+    def empty() -> "DetectionTable":
+        return DetectionTable(np.zeros(0), np.zeros(0), np.zeros((0, 4)), np.zeros(0))
+
+    @staticmethod
+    def from_raw(xml_path: Path, raw: Dict[str, list], frame_count: Optional[int] = None,
+                 drop_invalid: bool = True, report: bool = True) -> "DetectionTable":
+        """
+        :param xml_path: path of the CVAT XML file (for the warnings)
+        :param raw: attributes of the boxes, as read from the XML (see `RAW_FIELDS`)
+        :param frame_count: number of frames of the task
+        :param drop_invalid: if True, the boxes that are not valid are discarded
+        :param report: if True, the violations are logged in a single summary
+            (they are always available in `table.violations`)
+        :return: table of the boxes; labels are mapped and boxes are validated in a single
+            vectorized pass
+        """
+        points = np.array([raw["xtl"], raw["ytl"], raw["xbr"], raw["ybr"]], dtype=str).astype(np.float64)
+        points = points.T.reshape(-1, 4)
+        width = np.array(raw["width"], dtype=np.int64)
+        height = np.array(raw["height"], dtype=np.int64)
+        ids = label_ids(raw["label"])
+
+        violations = validate_boxes(points, width, height)
+        violations["unknown label"] = ids < 0
+        counts = {k: int(np.count_nonzero(v)) for k, v in violations.items()}
+        if report:
+            report_violations(xml_path, counts)
+
+        invalid = np.zeros(len(points), dtype=bool)
+        for mask in violations.values():
+            invalid |= mask
+
+        occluded = np.array(raw["occluded"], dtype=str).astype(np.int64) == 1
+        frame = np.array(raw["frame"], dtype=np.int64)
+        keep = ~invalid if drop_invalid else slice(None)
+
+        table = DetectionTable(frame[keep], ids[keep], points[keep], occluded[keep], frame_count)
+        table.n_invalid = int(invalid.sum())
+        table.violations = counts
+        return table
+
+    @staticmethod
+    def from_xml(xml_path: Path, drop_invalid: bool = True) -> "DetectionTable":
+        """
+        :param xml_path: path of the CVAT XML file
+        :param drop_invalid: if True, the boxes that are not valid are discarded (see `from_raw`)
+        :return: table with all the boxes of the task
+        """
+        raw = new_raw_boxes()
+        frame_count = None
+        for event, elem, root in _iterparse(xml_path):
+            if elem.tag == "size" and frame_count is None:
+                frame_count = int(elem.text)
+            elif elem.tag == "image":
+                add_raw_boxes(raw, elem)
+                elem.clear()
+                root.clear()
+        return DetectionTable.from_raw(xml_path, raw, frame_count, drop_invalid)
+
+    def __len__(self) -> int:
+        return len(self.frame)
+
+    def __getitem__(self, item: Union[slice, np.ndarray]) -> "DetectionTable":
+        """
+        :return: table with the selected boxes (a view, if `item` is a slice)
+        """
+        table = DetectionTable.__new__(DetectionTable)
+        table.frame = self.frame[item]
+        table.label_id = self.label_id[item]
+        table.points = self.points[item]
+        table.occluded = self.occluded[item]
+        table.frame_count = self.frame_count
+        table.n_invalid = 0
+        table.violations = {}
+        table.frame_ids, table._starts = np.unique(table.frame, return_index=True)
+        table._stops = np.append(table._starts[1:], len(table.frame))
+        return table
+
+    def __iter__(self) -> Iterator[Detection]:
+        for i in range(len(self)):
+            yield Detection(self, i)
+
+    @property
+    def centroids(self) -> np.ndarray:
+        """
+        :return: (n, 2) centroid of each box
+        """
+        return (self.points[:, :2] + self.points[:, 2:]) / 2.
+
+    @property
+    def labels(self) -> List[str]:
+        """
+        :return: LABEL_MAP label of each box
+        """
+        return [LABEL_NAMES[i] for i in self.label_id.tolist()]
+
+    def frame_slice(self, frame_index: int) -> slice:
+        """
+        :return: rows of the boxes of the required frame
+        """
+        pos = np.searchsorted(self.frame_ids, frame_index)
+        if pos < len(self.frame_ids) and self.frame_ids[pos] == frame_index:
+            return slice(int(self._starts[pos]), int(self._stops[pos]))
+        return slice(0, 0)
+
+    def frame_view(self, frame_index: int) -> "DetectionTable":
+        """
+        :return: (zero-copy) table with the boxes of the required frame
+        """
+        return self[self.frame_slice(frame_index)]
+
+    def to_array(self) -> np.ndarray:
+        """
+        :return: array of shape (n_boxes, 6) with columns (frame, label_id, xtl, ytl, xbr, ybr)
+        """
+        return np.concatenate([self.frame[:, None], self.label_id[:, None], self.points], axis=1).astype(np.float64)
+
+    def by_frame(self) -> List[List[Detection]]:
+        """
+        :return: list with the detections (views) of each of the `frame_count` frames
+        """
+        detections_by_frame = [[] for _ in range(max(self.frame_count, int(self.frame_ids[-1]) + 1
+                                                     if len(self.frame_ids) else 0))]
+        for i, frame_index in enumerate(self.frame.tolist()):
+            detections_by_frame[frame_index].append(Detection(self, i))
+        return detections_by_frame
+
+
+# attributes of the boxes collected by `add_raw_boxes`
+RAW_FIELDS = ("frame", "width", "height", "xtl", "ytl", "xbr", "ybr", "label", "occluded")
+
+
+def new_raw_boxes() -> Dict[str, list]:
+    return {k: [] for k in RAW_FIELDS}
+
+
+def add_raw_boxes(raw: Dict[str, list], image_tag: ET.Element) -> Tuple[int, int, int]:
+    """
+    Append the (unparsed) attributes of the boxes of an <image> node to `raw`
+
+    :return: frame index, width and height of the image
+    """
+    frame_index = int(image_tag.attrib["id"])
+    frame_width = int(image_tag.attrib["width"])
+    frame_height = int(image_tag.attrib["height"])
+
+    n_boxes = 0
+    for box_tag in image_tag.iter("box"):
+        attrib = box_tag.attrib
+        for k in ("xtl", "ytl", "xbr", "ybr", "label", "occluded"):
+            raw[k].append(attrib[k])
+        n_boxes += 1
+
+    raw["frame"] += [frame_index] * n_boxes
+    raw["width"] += [frame_width] * n_boxes
+    raw["height"] += [frame_height] * n_boxes
+
+    return frame_index, frame_width, frame_height
+
+
+def _iterparse(xml_path: Path) -> Iterator[Tuple[str, ET.Element, ET.Element]]:
+    """
+    :return: iterator over the ("end", element, root) of the CVAT XML file
+    """
+    root = None
+    for event, elem in ET.iterparse(str(xml_path), events=("start", "end")):
+        if root is None:
+            root = elem
+        if event == "end":
+            yield event, elem, root
 
 
 def parse_cvat_images_xml(xml_path: Path) -> List[List[Detection]]:
@@ -94,58 +325,87 @@ def parse_cvat_images_xml(xml_path: Path) -> List[List[Detection]]:
 
     frame_count = int(root.find("meta/task/size").text)
 
-    detections_by_frame = [[] for _ in range(frame_count)]
-
     # all the images must have same dimension
+    raw = new_raw_boxes()
     dimensions = set()
     for image_tag in root.findall('image'):
-        frame_index = int(image_tag.attrib["id"])
-        frame_width = int(image_tag.attrib["width"])
-        frame_height = int(image_tag.attrib["height"])
+        _, frame_width, frame_height = add_raw_boxes(raw, image_tag)
         dimensions.add((frame_width, frame_height))
 
-        for box_tag in image_tag.findall('box'):
-            f1 = float(box_tag.attrib["xtl"])
-            f2 = float(box_tag.attrib["ytl"])
-            f3 = float(box_tag.attrib["xbr"])
-            f4 = float(box_tag.attrib["ybr"])
+    table = DetectionTable.from_raw(xml_path, raw, frame_count, drop_invalid=False)
+
+    if table.n_invalid > 0 or len(dimensions) != 1:
+        # logger.warning(f"task {str(xml_path)} has images with different sizes")
+        return [[] for _ in range(frame_count)]
+
+    return table.by_frame()
+
 
-            if f1 < 0:
-                print("frame width f1 < 0: ", f1)
+def iter_cvat_tables(xml_path: Path, frames: Optional[Collection[int]] = None) \
+        -> Iterator[Tuple[int, DetectionTable]]:
+    """
+    Streaming version of `DetectionTable.from_xml`: the file is read with `iterparse`
+    and the boxes are yielded one frame at a time, in file order, as `(frame_index, table)`;
+    parsed elements are cleared as soon as they are used. Boxes that are not valid
+    are skipped and summarized in a single warning at the end of the file.
 
-            if f3 < 0:
-                print("frame width f3 < 0: ", f3)
+    :param xml_path: path of the CVAT XML file
+    :param frames: if given, only the boxes of these frames are read (and yielded)
+    """
+    logger.info(f"processing xml {xml_path.name}")
 
-            if f2 < 0:
-                print("frame height f2 < 0: ", f2)
+    frames = None if frames is None else set(frames)
+    dimensions = set()
+    violations = {}  # type: Dict[str, int]
+    for event, elem, root in _iterparse(xml_path):
+        if elem.tag != "image":
+            continue
+        if frames is not None and int(elem.attrib["id"]) not in frames:
+            elem.clear()
+            root.clear()
+            continue
+
+        raw = new_raw_boxes()
+        frame_index, frame_width, frame_height = add_raw_boxes(raw, elem)
 
-            if f4 < 0:
-                print("frame height f4 < 0: ", f4)
+        dimensions.add((frame_width, frame_height))
+        if len(dimensions) == 2:
+            logger.warning(f"task {str(xml_path)} has images with different sizes")
 
-            if f1 > frame_width:
-                print("frame width f1 > width: ", f1)
+        # violations are summarized for the whole file below
+        table = DetectionTable.from_raw(xml_path, raw, drop_invalid=True, report=False)
+        for k, n in table.violations.items():
+            violations[k] = violations.get(k, 0) + n
 
-            if f3 > frame_width:
-                print("frame width f3 > width: ", f3)
+        yield frame_index, table
 
-            if f2 > frame_height:
-                print("frame height f2 > height: ", f2)
+        # free the memory of the frames already processed
+        elem.clear()
+        root.clear()
 
-            if f4 > frame_height:
-                print("frame height f4 > height: ", f4)
+    report_violations(xml_path, violations)
 
-            if not (0 <= f1 <= frame_width) or not (0 <= f3 <= frame_width) or not (0 <= f2 <= frame_height) or not (
-                    0 <= f4 <= frame_height):
-                logger.warning(f"task {str(xml_path)} has not valid bounding boxes")
-                return [[] for _ in range(frame_count)]
 
-            label = box_tag.attrib["label"]
-            occluded = int(box_tag.attrib["occluded"])
-            outside = False
-            detections_by_frame[frame_index].append(Detection(f1, f2, f3, f4, label, outside, occluded == 1))
+def iter_cvat_images_xml(xml_path: Path, as_array: bool = False) \
+        -> Iterator[Tuple[int, Union[List[Detection], np.ndarray]]]:
+    """
+    Streaming version of `parse_cvat_images_xml` (see `iter_cvat_tables`),
+    yielding `(frame_index, detections)` one frame at a time.
+
+    Unlike `parse_cvat_images_xml`, a box that is not valid is skipped (with a warning)
+    instead of discarding the whole task, and the file must be a well-formed XML document.
+
+    :param xml_path: path of the CVAT XML file
+    :param as_array: if True, the detections of each frame are returned as an array of
+        shape (n_boxes, 6) with columns (frame, label_id, xtl, ytl, xbr, ybr)
+    """
+    for frame_index, table in iter_cvat_tables(xml_path):
+        yield frame_index, (table.to_array() if as_array else list(table))
 
-    if len(dimensions) != 1:
-        # logger.warning(f"task {str(xml_path)} has images with different sizes")
-        return [[] for _ in range(frame_count)]
 
-    return detections_by_frame
+def cvat_images_xml_to_array(xml_path: Path) -> np.ndarray:
+    """
+    :param xml_path: path of the CVAT XML file
+    :return: array of shape (n_boxes, 6) with columns (frame, label_id, xtl, ytl, xbr, ybr)
+    """
+    return DetectionTable.from_xml(xml_path).to_array()
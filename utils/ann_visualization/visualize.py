@@ -1,25 +1,34 @@
 # -*- coding: utf-8 -*-
 # ---------------------
 
+import itertools
 import json
 import os
+import queue
 import sys
+import threading
+import time
 from typing import *
 
 import click
-import imageio
-import matplotlib.pyplot as plt
 import numpy as np
 from path import Path
 
-from utils.ann_visualization.joint import Joint
-from utils.ann_visualization.pose import Pose
+from utils.ann_visualization.pose_batch import PoseBatch
 import cv2
 
-from utils.ann_visualization.utils_imavis import parse_cvat_images_xml
+from utils.ann_visualization.utils_imavis import DetectionTable, iter_cvat_tables
+from utils.geometry import FrameSize
+from utils.profiling import Profiler
+from utils.sequence_cache import load_sequence
+from utils.sequence_index import SequenceIndex, select_frames
 
 MAX_COLORS = 42
 
+# when rendering a selection of frames, the decoder seeks (instead of decoding
+# the frames in between) only if the next frame is more than SEEK_MIN_GAP frames ahead
+SEEK_MIN_GAP = 32
+
 # check python version
 assert sys.version_info >= (3, 6), '[!] This script requires Python >= 3.6'
 
@@ -31,70 +40,334 @@ def get_colors(number_of_colors, cmap_name='rainbow'):
     :param cmap_name: name of the colormap you want to use
     :return: list of 'number_of_colors' colors based on the required color map ('cmap_name')
     """
+    import matplotlib.pyplot as plt  # heavy: imported only when colors are needed
+
     colors = plt.get_cmap(cmap_name)(np.linspace(0, 1, number_of_colors))[:, :-1] * 255
     return colors.astype(int).tolist()
 
 
-def get_pose(frame_data, person_id):
-    # type: (np.ndarray, int) -> Pose
-    """
-    :param frame_data: data of the current frame
-    :param person_id: person identifier
-    :return: list of joints in the current frame with the required person ID
-    """
-    pose = [Joint(j) for j in frame_data[frame_data[:, 1] == person_id]]
-    pose.sort(key=(lambda j: j.type))
-    return Pose(pose)
-
-
 H1 = 'path of the video you want to visualize annotations'
 H2 = 'path of JSON containing the annotations you want to visualize'
 H3 = 'path of the output video with the annotations'
 H4 = 'if `hide` the annotations of people completely occluded by objects will not be displayed in the output video'
 
 
+def draw_frame(image, detections, poses, colors, hide):
+    # type: (np.ndarray, DetectionTable, Optional[PoseBatch], List[List[int]], bool) -> np.ndarray
+    """
+    Draw (in place) the CVAT boxes and, if given, the JTA poses of a frame
+
+    :param image: frame on which to draw
+    :param detections: CVAT boxes of the frame
+    :param poses: JTA poses of the frame (or None)
+    :param colors: color map
+    :param hide: if True, completely occluded poses are not drawn
+    :return: image with the annotations
+    """
+    # all the boxes have the same color
+    color = colors[int(25) % len(colors)]
+    for xtl, ytl, xbr, ybr in detections.points.astype(int).tolist():
+        image = cv2.rectangle(image, (xtl, ytl), (xbr, ybr), color, 2)
+
+    if poses is not None:
+        # select pose color base on its unique identifier
+        pose_colors = [colors[p_id % len(colors)] for p_id in poses.person_ids.tolist()]
+        image = poses.draw(image, pose_colors, mask=~poses.invisible if hide else None)
+
+    return image
+
+
+def decode_into_buffers(reader, to_draw, free_buffers, errors, n_buffers, macro_block_size=16, profiler=None,
+                        stop=None):
+    """
+    Decoding stage of `visualize`: every frame is copied into a preallocated buffer
+    whose height is padded to a multiple of `macro_block_size` (as required by the encoder);
+    (frame_number, buffer, height) items are put in `to_draw`, followed by None
+
+    :param n_buffers: maximum number of buffers to allocate; then buffers are recycled from `free_buffers`
+    :param profiler: if given, the decoding time is recorded in its 'decode' stage
+    :param stop: if given and set, decoding stops before the next frame (the consumer must keep
+        draining `to_draw`, until None, so that the decoder is never blocked)
+    """
+    profiler = Profiler('decode') if profiler is None else profiler
+    frames = iter(reader)
+    n_allocated = 0
+    try:
+        for frame_number in itertools.count():
+            if stop is not None and stop.is_set():
+                break
+            with profiler.stage('decode'):
+                image = next(frames, None)
+            if image is None:
+                break
+
+            height = image.shape[0]
+            if n_allocated < n_buffers:
+                padded_height = height + (-height) % macro_block_size
+                buffer = np.empty((padded_height,) + image.shape[1:], dtype=image.dtype)
+                n_allocated += 1
+            else:
+                buffer = free_buffers.get()
+
+            buffer[:height] = image
+            to_draw.put((frame_number, buffer, height))
+    except Exception as e:
+        errors.append(e)
+    finally:
+        to_draw.put(None)
+
+
+def encode_buffers(writer, to_encode, free_buffers, errors, profiler=None):
+    """
+    Encoding stage of `visualize`: buffers are taken from `to_encode` (until None),
+    encoded and given back to `free_buffers`
+
+    :param profiler: if given, the encoding time is recorded in its 'encode' stage
+    """
+    profiler = Profiler('encode') if profiler is None else profiler
+    while True:
+        buffer = to_encode.get()
+        if buffer is None:
+            break
+        if not errors:
+            try:
+                with profiler.stage('encode'):
+                    writer.append_data(buffer)
+            except Exception as e:
+                # keep draining the queue so that the drawing stage never blocks
+                errors.append(e)
+        free_buffers.put(buffer)
+
+
+def resolve_frames(n_frames, frames, max_frames=None):
+    # type: (int, Union[slice, Sequence[int]], Optional[int]) -> List[int]
+    """
+    :param n_frames: number of frames of the video
+    :param frames: frames to render, as a slice (e.g. `slice(100, 500, 10)`) or as frame numbers
+    :param max_frames: if given, at most `max_frames` frames (evenly spaced) of the selection are kept
+    :return: sorted numbers of the (existing) frames to render
+    """
+    if isinstance(frames, slice):
+        frame_ids = np.arange(*frames.indices(n_frames))
+    else:
+        frame_ids = np.unique(np.asarray(frames, dtype=np.int64))
+        frame_ids = frame_ids[(frame_ids >= 0) & (frame_ids < n_frames)]
+    return select_frames(frame_ids, max_frames=max_frames)
+
+
+def seek_frames(capture, frame_numbers, profiler=None):
+    # type: (cv2.VideoCapture, Sequence[int], Optional[Profiler]) -> Iterator[Tuple[int, np.ndarray]]
+    """
+    Decode only the required frames of a video: the decoder jumps to a frame with a
+    (keyframe) seek when it is more than `SEEK_MIN_GAP` frames ahead, otherwise the
+    frames in between are grabbed without being converted
+
+    :param capture: (open) video
+    :param frame_numbers: sorted numbers of the frames to decode
+    :param profiler: if given, the decoding time is recorded in its 'decode' stage
+    :return: iterator over the (frame_number, RGB image) of the required frames
+    """
+    profiler = Profiler('decode') if profiler is None else profiler
+    position = 0  # number of the next frame returned by the decoder
+    for frame_number in frame_numbers:
+        with profiler.stage('decode'):
+            if frame_number - position > SEEK_MIN_GAP:
+                capture.set(cv2.CAP_PROP_POS_FRAMES, frame_number)
+                position = frame_number
+            while position < frame_number and capture.grab():
+                position += 1
+            ok, image = capture.read()
+            position += 1
+        if not ok:
+            break
+        yield frame_number, cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+
+def visualize_frames(in_mp4_file_path, xml_file_path, out_path, frames, hide, json_file_path=None, max_frames=None,
+                     stills=False, profiler=None):
+    """
+    Render only a selection of the frames of a video (see `visualize`): the video is not
+    decoded from the start, but the decoder seeks to the required frames, and only the
+    CVAT boxes of those frames are parsed
+
+    :param frames: frames to render, as a slice or as frame numbers (see `resolve_frames`)
+    :param max_frames: if given, at most `max_frames` frames (evenly spaced) of the selection are rendered
+    :param stills: if True, `out_path` is a folder and every frame is saved as `<frame_number>.jpg`;
+        otherwise the frames are encoded into a (short) video
+    :return: numbers of the rendered frames
+    """
+    profiler = Profiler('render') if profiler is None else profiler
+
+    out_path = Path(out_path)
+    out_dir = out_path if stills else out_path.parent
+    if not out_dir.exists() and out_dir != Path(''):
+        out_dir.makedirs()
+
+    capture = cv2.VideoCapture(str(in_mp4_file_path))
+    n_frames = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+    frame_size = FrameSize(int(capture.get(cv2.CAP_PROP_FRAME_WIDTH)), int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+    frame_numbers = resolve_frames(n_frames, frames, max_frames)
+
+    index = None
+    if json_file_path is not None:
+        with profiler.stage('load'):
+            index = SequenceIndex(load_sequence(json_file_path), frame_size=frame_size)
+
+    with profiler.stage('parse'):
+        detections = dict(iter_cvat_tables(Path(xml_file_path), frames=frame_numbers))
+
+    colors = get_colors(number_of_colors=MAX_COLORS, cmap_name='jet')
+    no_detections = DetectionTable.empty()
+
+    writer = None
+    if not stills:
+        import imageio  # heavy: imported only when a video is rendered
+        writer = imageio.get_writer(out_path, fps=20)
+
+    print(f'▸ visualizing {len(frame_numbers)} frames of \'{Path(in_mp4_file_path).abspath()}\'')
+    rendered = []
+    try:
+        for frame_number, image in seek_frames(capture, frame_numbers, profiler=profiler):
+            with profiler.stage('draw'):
+                poses = index.poses(frame_number) if index is not None else None
+                image = draw_frame(image, detections.get(frame_number, no_detections), poses, colors, hide)
+
+            with profiler.stage('encode'):
+                if stills:
+                    cv2.imwrite(str(out_path / f'{frame_number}.jpg'), cv2.cvtColor(image, cv2.COLOR_RGB2BGR))
+                else:
+                    # replicate the last rows, as `decode_into_buffers` does, instead of letting the encoder resize
+                    pad = (-image.shape[0]) % 16
+                    writer.append_data(np.concatenate([image, image[image.shape[0] - pad:]]) if pad > 0 else image)
+
+            rendered.append(frame_number)
+            profiler.count('frames')
+            print(f'\r▸ progress: {100 * (len(rendered) / len(frame_numbers)):6.2f}%', end='')
+    finally:
+        capture.release()
+        if writer is not None:
+            writer.close()
+
+    print(f'\n▸ annotated frames: \'{out_path.abspath()}\'\n')
+    return rendered
+
+
 # @click.command()
 # @click.option('--in_mp4_file_path', type=click.Path(exists=True), prompt='Enter \'in_mp4_file_path\'', help=H1)
 # @click.option('--json_file_path', type=click.Path(exists=True), prompt='Enter \'json_file_path\'', help=H2)
 # @click.option('--out_mp4_file_path', type=click.Path(), prompt='Enter \'out_mp4_file_path\'', help=H3)
 # @click.option('--hide/--no-hide', default=True, help=H4)
-def visualize(in_mp4_file_path, xml_file_path, out_mp4_file_path, hide, plot_bbox=False):
+def visualize(in_mp4_file_path, xml_file_path, out_mp4_file_path, hide, plot_bbox=False, json_file_path=None,
+              queue_size=8, profiler=None, frames=None, max_frames=None, stills=False):
     """
-    Script that provides a visual representation of the annotations
+    Script that provides a visual representation of the annotations;
+    if `json_file_path` is given, the JTA poses are drawn on top of the CVAT boxes.
+    Decoding, drawing and encoding run in separate threads connected by bounded queues
+    (at most `queue_size` frames waiting between two stages).
+    If `profiler` is given, the time spent in each stage (load, parse, decode, draw, encode)
+    is recorded in it; the stages overlap, so their sum can exceed the wall time.
+    If `frames`, `max_frames` or `stills` are given, only a selection of the frames is
+    rendered, seeking through the video (see `visualize_frames`).
     """
+    if frames is not None or max_frames is not None or stills:
+        return visualize_frames(in_mp4_file_path, xml_file_path, out_mp4_file_path,
+                                slice(None) if frames is None else frames, hide, json_file_path=json_file_path,
+                                max_frames=max_frames, stills=stills, profiler=profiler)
+
+    profiler = Profiler('render') if profiler is None else profiler
+
     out_mp4_file_path = Path(out_mp4_file_path)
     if not out_mp4_file_path.parent.exists() and out_mp4_file_path.parent != Path(''):
         out_mp4_file_path.parent.makedirs()
 
+    import imageio  # heavy: imported only when a video is rendered
+
     reader = imageio.get_reader(in_mp4_file_path)
     writer = imageio.get_writer(out_mp4_file_path, fps=20)
 
-    # with open(json_file_path, 'r') as json_file:
-    #    data = json.load(json_file)
-    #    data = np.array(data)
+    n_frames = reader.get_meta_data().get('nframes', float('inf'))
+
+    index = None
+    if json_file_path is not None:
+        with profiler.stage('load'):
+            # joints are on screen if inside the frames of the video
+            width, height = reader.get_meta_data()['size']
+            index = SequenceIndex(load_sequence(json_file_path), frame_size=FrameSize(width, height))
 
     colors = get_colors(number_of_colors=MAX_COLORS, cmap_name='jet')
 
-    detections_by_frame = parse_cvat_images_xml(Path(xml_file_path))
+    # detections are parsed lazily, while the video is decoded
+    detections_stream = iter_cvat_tables(Path(xml_file_path))
+    no_detections = DetectionTable.empty()
+    next_frame, next_detections = next(detections_stream, (None, no_detections))
+
+    to_draw = queue.Queue(maxsize=queue_size)
+    to_encode = queue.Queue(maxsize=queue_size)
+    free_buffers = queue.Queue()
+    errors = []
+    stop = threading.Event()
+
+    # every buffer is either in a queue, being decoded, drawn or encoded
+    n_buffers = 2 * queue_size + 3
+    decoder = threading.Thread(target=decode_into_buffers, args=(reader, to_draw, free_buffers, errors, n_buffers),
+                               kwargs={'profiler': profiler, 'stop': stop}, daemon=True)
+    encoder = threading.Thread(target=encode_buffers, args=(writer, to_encode, free_buffers, errors),
+                               kwargs={'profiler': profiler}, daemon=True)
+    decoder.start()
+    encoder.start()
 
     print(f'▸ visualizing annotations of \'{Path(in_mp4_file_path).abspath()}\'')
-    for frame_number, image in enumerate(reader):
+    t0 = time.perf_counter()
+    decoded = False
+    try:
+        while True:
+            item = to_draw.get()
+            if item is None:
+                decoded = True
+                break
+            frame_number, buffer, height = item
+
+            with profiler.stage('parse'):
+                frame_detections = no_detections
+                while next_frame is not None and next_frame <= frame_number:
+                    if next_frame == frame_number:
+                        frame_detections = next_detections
+                    next_frame, next_detections = next(detections_stream, (None, no_detections))
+
+            with profiler.stage('draw'):
+                poses = index.poses(frame_number) if index is not None else None
 
-        for det in detections_by_frame[frame_number]:
-            # select pose color base on its unique identifier
-            color = colors[int(25) % len(colors)]
+                # draw in place, then replicate the last rows into the padding
+                draw_frame(buffer[:height], frame_detections, poses, colors, hide)
+                pad = buffer.shape[0] - height
+                if pad > 0:
+                    buffer[height:] = buffer[height - pad:height]
 
-            # draw pose on image
-            bbox = np.array(det.points).astype(int)
+            to_encode.put(buffer)
+            profiler.count('frames')
 
-            xtl, ytl, xbr, ybr = bbox
+            fps = (frame_number + 1) / (time.perf_counter() - t0)
+            if n_frames != float('inf'):
+                print(f'\r▸ progress: {100 * ((frame_number + 1) / n_frames):6.2f}% ({fps:.1f} fps)', end='')
+            else:
+                print(f'\r▸ progress: {frame_number + 1} frames ({fps:.1f} fps)', end='')
+    finally:
+        # on failure, stop the decoder and drain its queue (giving the buffers back),
+        # so that it is never left blocked on `to_draw` or `free_buffers`
+        if not decoded:
+            stop.set()
+            for item in iter(to_draw.get, None):
+                free_buffers.put(item[1])
+        decoder.join()
 
-            image = cv2.rectangle(image, (xtl, ytl), (xbr, ybr), color, 2)
+        to_encode.put(None)
+        encoder.join()
+        writer.close()
+        reader.close()
 
-        writer.append_data(np.vstack([image, image[-8:, :]]))
-        print(f'\r▸ progress: {100 * (frame_number / 1800):6.2f}%', end='')
+    if errors:
+        raise errors[0]
 
-    writer.close()
     print(f'\n▸ video with annotations: \'{out_mp4_file_path.abspath()}\'\n')
 
 
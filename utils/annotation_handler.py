@@ -1,8 +1,5 @@
 import os
 
-import pandas as pd
-import tqdm, json
-
 dict_ann = {
 
     "frame": 0,
@@ -23,6 +20,70 @@ dict_ann = {
 JTA_dataset_cols = ['frame', 'pedestrian_id', 'joint_type', '2D_x', '2D_y', '3D_x', '3D_y',
                     '3D_z', 'occluded', 'self_occluded']
 
+JTA_dataset_dtypes = {
+    'frame': 'int64',
+    'pedestrian_id': 'int64',
+    'joint_type': 'int64',
+    '2D_x': 'float64',
+    '2D_y': 'float64',
+    '3D_x': 'float64',
+    '3D_y': 'float64',
+    '3D_z': 'float64',
+    # 0/1 flags: read (and written to the JTA JSON) as integers, not as booleans
+    'occluded': 'int64',
+    'self_occluded': 'int64',
+}
+
+
+def read_coords_csv(csv_path, engine="c"):
+    """
+    :param csv_path: path of the `coords.csv` file of a sequence
+    :param engine: pandas CSV engine ("c" or "pyarrow")
+    :return: DataFrame with only the JTA columns (in JTA order), with explicit dtypes
+    """
+    import pandas as pd  # heavy: imported only when a CSV is actually read
+
+    df = pd.read_csv(csv_path, usecols=JTA_dataset_cols, dtype=JTA_dataset_dtypes, engine=engine)
+    return df[JTA_dataset_cols]
+
+
+def read_coords_fov(csv_path, engine="c"):
+    """
+    :param csv_path: path of the `coords.csv` file of a sequence
+    :param engine: pandas CSV engine ("c" or "pyarrow")
+    :return: (frames, fov): sorted frame numbers and field of view [deg] of the camera in each
+        of them, or None if `coords.csv` does not record the field of view
+    """
+    import pandas as pd  # heavy: imported only when a CSV is actually read
+
+    if "fov" not in pd.read_csv(csv_path, nrows=0).columns:
+        return None
+
+    df = pd.read_csv(csv_path, usecols=["frame", "fov"], dtype={"frame": "int64", "fov": "float64"}, engine=engine)
+    df = df.drop_duplicates("frame").sort_values("frame")
+    return df["frame"].to_numpy(), df["fov"].to_numpy()
+
+
+def csv_to_jta(seq_path, out_path=None, engine="c"):
+    """
+    Conversion of the `coords.csv` of a sequence to the JTA dataset JSON
+    (a list with one [frame, pedestrian_id, joint_type, 2D_x, ..., self_occluded] row per joint)
+
+    :param seq_path: sequence folder containing `coords.csv`
+    :param out_path: path of the output JSON; default: `<seq_path>/<seq_name>.json`
+    :param engine: pandas CSV engine ("c" or "pyarrow")
+    :return: path of the output JSON
+    """
+    if out_path is None:
+        seq_name = os.path.basename(os.path.normpath(seq_path))
+        out_path = os.path.join(seq_path, f"{seq_name}.json")
+
+    df = read_coords_csv(os.path.join(seq_path, "coords.csv"), engine=engine)
+    df.to_json(out_path, orient="values", double_precision=15)
+
+    return out_path
+
+
 if __name__ == "__main__":
 
     # Conversation to JTA DATASET JASON
@@ -31,12 +92,4 @@ if __name__ == "__main__":
         seq_path = f"C:\\Users\\simoc\\Desktop\\Synthetic Data IMAVIS\\seq_{j}"
 
         print(seq_path)
-        df = pd.read_csv(os.path.join(seq_path, "coords.csv"))
-
-        ann = []
-
-        for i, row in tqdm.tqdm(enumerate(df.iterrows())):
-            ann.append(row[1][JTA_dataset_cols].tolist())
-
-        with open(os.path.join(seq_path, f"seq_{j}.json"), "w") as f:
-            json.dump(ann, f)
+        csv_to_jta(seq_path, os.path.join(seq_path, f"seq_{j}.json"))
@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+# ---------------------
+
+import json
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import *
+
+import click
+from path import Path
+
+from utils.geometry import IMAGE_EXTENSIONS, FrameSize, sequence_frame_size
+from utils.manifest import Manifest
+from utils.profiling import Profiler
+
+# conversions, in dependency order: `cvat` and `coco` read the JSON written by `jta`,
+# `render` (QA video with the CVAT boxes) reads the output of `cvat` and the frames
+# (or, for sequences without frames, the output of `video`)
+TASKS = ('jta', 'video', 'cvat', 'coco', 'render')
+
+
+def has_frames(seq_dir):
+    # type: (str) -> bool
+    """
+    :return: True if the sequence folder contains its frames (`<n>.jpg`, ...)
+    """
+    with os.scandir(seq_dir) as entries:
+        return any(e.is_file() and e.name.lower().endswith(IMAGE_EXTENSIONS) for e in entries)
+
+
+def is_sequence_dir(folder):
+    # type: (str) -> bool
+    """
+    :return: True if `folder` is a sequence folder, i.e. it contains `coords.csv` or `<seq_name>.json`
+        (other folders of the dataset root, e.g. rendered stills, are not sequences)
+    """
+    name = os.path.basename(os.path.normpath(folder))
+    return os.path.isfile(os.path.join(folder, 'coords.csv')) or os.path.isfile(os.path.join(folder, f'{name}.json'))
+
+
+def task_spec(task, seq_dir):
+    # type: (str, str) -> Tuple[List[str], str, Dict]
+    """
+    :param task: conversion name (one of `TASKS`)
+    :param seq_dir: sequence folder (e.g. `.../seq_3`)
+    :return: (input paths, output path, parameters) of the conversion
+    """
+    name = os.path.basename(os.path.normpath(seq_dir))
+    json_path = os.path.join(seq_dir, f'{name}.json')
+    mp4_path = os.path.join(seq_dir, f'{name}.mp4')
+    xml_path = os.path.join(seq_dir, f'{name}_CVAT.xml')
+
+    if task == 'jta':
+        from utils.annotation_handler import JTA_dataset_cols
+        return [os.path.join(seq_dir, 'coords.csv')], json_path, {'columns': JTA_dataset_cols}
+    if task in ('video', 'cvat', 'coco'):
+        # the outputs depend on the size of the frames of the sequence
+        frame_size = sequence_frame_size(seq_dir)
+
+    if task == 'video':
+        # checked here, and not only by `frames_to_video`, so that an empty video
+        # recorded in the manifest by an older run is never considered up to date
+        if not has_frames(seq_dir):
+            raise FileNotFoundError(f'[!] no frames in \'{seq_dir}\'')
+        return [seq_dir], mp4_path, {'fps': 20, 'width': frame_size.width, 'height': frame_size.height}
+    if task == 'cvat':
+        from utils import CVAT_style
+        return [json_path], xml_path, {
+            'h_inc_perc': CVAT_style.BBOX_H_INC_PERC,
+            'w_inc_perc': CVAT_style.BBOX_W_INC_PERC,
+            'frame_width': frame_size.width,
+            'frame_height': frame_size.height,
+        }
+    if task == 'coco':
+        from utils.coco_style_convert import IMAGE_ID_STRIDE
+        return [json_path], os.path.join(seq_dir, f'{name}.coco.json'), {
+            'width': frame_size.width,
+            'height': frame_size.height,
+            'image_id_stride': IMAGE_ID_STRIDE,
+            'frame_stride': 1,
+        }
+    if task == 'render':
+        # boxes are drawn directly on the frames, if any: no encode/decode round trip
+        source = 'frames' if has_frames(seq_dir) else 'video'
+        inputs = [seq_dir if source == 'frames' else mp4_path, xml_path]
+        return inputs, os.path.join(seq_dir, f'res_{name}_cvat.mp4'), {'hide': True, 'source': source}
+    raise ValueError(f'unknown task \'{task}\'')
+
+
+def run_task(task, seq_dir, profiler=None):
+    # type: (str, str, Optional[Profiler]) -> str
+    """
+    Run a single conversion on a sequence folder
+
+    :param profiler: if given, the time spent in each stage of the conversion is recorded in it
+    :return: path of the output
+    """
+    inputs, out_path, params = task_spec(task, seq_dir)
+
+    if task == 'jta':
+        from utils.annotation_handler import csv_to_jta
+        return csv_to_jta(seq_dir, out_path)
+    if task == 'video':
+        from utils.frames_seq_to_video import frames_to_video
+        return frames_to_video(seq_dir, out_path, fps_video=params['fps'], width=params['width'],
+                               height=params['height'], show=False, profiler=profiler)
+    if task == 'cvat':
+        from utils.CVAT_style import json_imavis_style_conversion
+        return json_imavis_style_conversion(inputs[0], seq_dir, verbose=False, profiler=profiler,
+                                            frame_size=FrameSize(params['frame_width'], params['frame_height']))
+    if task == 'coco':
+        from utils.coco_style_convert import convert_sequence
+        return convert_sequence(inputs[0], out_path, verbose=False, frame_stride=params['frame_stride'],
+                                profiler=profiler, frame_size=FrameSize(params['width'], params['height']))
+    if task == 'render':
+        if params['source'] == 'frames':
+            from utils.ann_visualization.overlay import overlay_frames
+            return overlay_frames(inputs[0], out_path, xml_file_path=inputs[1], hide=params['hide'], workers=1,
+                                  profiler=profiler)
+        from utils.ann_visualization.visualize import visualize
+        visualize(inputs[0], inputs[1], out_path, hide=params['hide'], profiler=profiler)
+        return out_path
+    raise ValueError(f'unknown task \'{task}\'')
+
+
+def run_job(seq_dir, tasks, resume=True, hash_files=False, profile=False, trace_memory=False):
+    # type: (str, Sequence[str], bool, bool, bool, bool) -> List[Dict]
+    """
+    Run the required conversions on a sequence folder; a failing conversion
+    does not stop the following ones. Every output is recorded in the manifest
+    of the sequence (see `Manifest`)
+
+    :param resume: if True, only the outputs that are out of date are rebuilt
+    :param hash_files: if True, inputs are also compared by content hash
+    :param profile: if True, every conversion is also profiled with `cProfile`
+    :param trace_memory: if True, the peak memory of every conversion is measured with `tracemalloc`
+    :return: one report per conversion: task, status ('done', 'skipped' or 'failed'), seconds, error
+        and the timings of its stages (see `Profiler.report`)
+    """
+    manifest = Manifest(seq_dir, hash_files=hash_files)
+
+    reports = []
+    for task in tasks:
+        report = {'task': task, 'status': 'done', 'seconds': 0.0, 'error': None, 'profile': None}
+        profiler = Profiler(task, profile=profile, trace_memory=trace_memory)
+        t0 = time.perf_counter()
+        try:
+            # e.g. unreadable frames or camera: only this conversion fails
+            inputs, out_path, params = task_spec(task, seq_dir)
+            if resume and not manifest.is_stale(task, out_path, inputs, params):
+                report['status'] = 'skipped'
+                reports.append(report)
+                continue
+
+            input_fingerprints = manifest.fingerprints(inputs)
+            with profiler:
+                run_task(task, seq_dir, profiler=profiler)
+            manifest.record(task, out_path, input_fingerprints, params)
+        except Exception:
+            report['status'] = 'failed'
+            report['error'] = traceback.format_exc()
+        report['seconds'] = time.perf_counter() - t0
+        report['profile'] = profiler.report()
+        reports.append(report)
+
+    return reports
+
+
+def run_batch(folder_data, tasks=TASKS, workers=1, resume=True, hash_files=False, report_path=None, profile=False,
+              trace_memory=False):
+    # type: (str, Sequence[str], int, bool, bool, Optional[str], bool, bool) -> Dict[str, List[Dict]]
+    """
+    Run the required conversions on all the sequence folders of `folder_data` (see `is_sequence_dir`),
+    one job per sequence, in a pool of `workers` processes
+
+    :param report_path: if given, the reports of the run are saved there as JSON
+    :param profile: if True, every conversion is also profiled with `cProfile` (see `run_job`)
+    :param trace_memory: if True, the peak memory of every conversion is measured (see `run_job`)
+    :return: reports of each sequence (see `run_job`)
+    """
+    tasks = [t for t in TASKS if t in tasks]
+    seq_dirs = sorted(str(d) for d in Path(folder_data).dirs() if is_sequence_dir(d))
+
+    results = {}
+
+    def log(seq_dir, reports):
+        results[seq_dir] = reports
+        summary = ', '.join(
+            f'{r["task"]} {r["status"]}' + (f' ({r["seconds"]:.1f}s)' if r['status'] != 'skipped' else '')
+            for r in reports
+        )
+        print(f'▸ [{len(results)}/{len(seq_dirs)}] {os.path.basename(seq_dir)}: {summary}')
+        for r in reports:
+            if r['status'] == 'failed':
+                print(f'[!] {os.path.basename(seq_dir)}/{r["task"]} failed:\n{r["error"]}')
+
+    t0 = time.perf_counter()
+    if workers <= 1:
+        for seq_dir in seq_dirs:
+            log(seq_dir, run_job(seq_dir, tasks, resume, hash_files, profile, trace_memory))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(run_job, seq_dir, tasks, resume, hash_files, profile, trace_memory): seq_dir
+                       for seq_dir in seq_dirs}
+            for future in as_completed(futures):
+                seq_dir = futures[future]
+                try:
+                    reports = future.result()
+                except Exception:
+                    # e.g. the worker process died
+                    reports = [{'task': t, 'status': 'failed', 'seconds': 0.0, 'error': traceback.format_exc(),
+                                'profile': None} for t in tasks]
+                log(seq_dir, reports)
+
+    n_failed = sum(any(r['status'] == 'failed' for r in reports) for reports in results.values())
+    print(f'▸ {len(results) - n_failed} sequences converted, {n_failed} failed')
+
+    if report_path is not None:
+        with open(report_path, 'w') as f:
+            json.dump({
+                'folder_data': str(folder_data),
+                'tasks': list(tasks),
+                'workers': workers,
+                'seconds': time.perf_counter() - t0,
+                'sequences': {os.path.basename(d): results[d] for d in sorted(results)},
+            }, f, indent=2)
+        print(f'▸ report: \'{Path(report_path).abspath()}\'')
+
+    return results
+
+
+H1 = 'dataset folder, containing one folder per sequence'
+H2 = 'conversion to run (can be repeated); default: all'
+H3 = 'number of worker processes'
+H4 = 'if `resume` only the outputs that are out of date (see the manifest of each sequence) are rebuilt'
+H5 = 'compare the inputs also by content hash, not only by size and mtime'
+H6 = 'path of the JSON report with the timings of each conversion stage'
+H7 = 'also profile every conversion with cProfile (slower)'
+H8 = 'also measure the peak memory of every conversion with tracemalloc (slower)'
+
+
+@click.command()
+@click.option('--folder_data', type=click.Path(exists=True, file_okay=False), prompt='Enter \'folder_data\'', help=H1)
+@click.option('--task', 'tasks', type=click.Choice(TASKS), multiple=True, help=H2)
+@click.option('--workers', type=int, default=os.cpu_count(), show_default=True, help=H3)
+@click.option('--resume/--no-resume', default=True, help=H4)
+@click.option('--hash/--no-hash', 'hash_files', default=False, help=H5)
+@click.option('--report', 'report_path', type=click.Path(dir_okay=False), default=None, help=H6)
+@click.option('--profile/--no-profile', default=False, help=H7)
+@click.option('--trace-memory/--no-trace-memory', default=False, help=H8)
+def main(folder_data, tasks, workers, resume, hash_files, report_path, profile, trace_memory):
+    """
+    Batch conversion of all the sequences of a dataset folder
+    """
+    results = run_batch(folder_data, tasks=tasks or TASKS, workers=workers, resume=resume, hash_files=hash_files,
+                        report_path=report_path, profile=profile, trace_memory=trace_memory)
+    if any(r['status'] == 'failed' for reports in results.values() for r in reports):
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
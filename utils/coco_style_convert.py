@@ -3,7 +3,10 @@
 
 import json
 import os
+import re
 import sys
+from concurrent.futures import ProcessPoolExecutor
+from typing import *
 
 import click
 import numpy as np
@@ -11,134 +14,292 @@ from path import Path
 
 from utils.ann_visualization.joint import Joint
 from utils.ann_visualization.pose import Pose
+from utils.ann_visualization.pose_batch import PoseBatch
+from utils.coco_writer import CocoWriter
+from utils.geometry import DEFAULT_FRAME_SIZE, FrameSize, sequence_frame_size
+from utils.profiling import Profiler
+from utils.sequence_cache import load_sequence
+from utils.sequence_index import SequenceIndex, select_frames
 
 MAX_COLORS = 42
 
+# image id = sequence * IMAGE_ID_STRIDE + frame number (unique for sequences with up to 100k frames)
+IMAGE_ID_STRIDE = 100000
+
+# JTA JSON of a sequence (e.g. `seq_3.json`); other JSON files (manifest, camera, ...) are skipped
+SEQUENCE_JSON_PATTERN = re.compile(r'seq_(\d+)\.json')
+
 # check python version
 assert sys.version_info >= (3, 6), '[!] This script requires Python >= 3.6'
 
 
-def get_pose(frame_data, person_id):
-    # type: (np.ndarray, int) -> Pose
+H1 = 'path of the output directory'
+
+
+def get_frame_coco_entries(sequence, frame_number, poses, visible=None):
+    # type: (int, int, PoseBatch, Optional[np.ndarray]) -> Tuple[Dict, List[Dict]]
+    """
+    :param sequence: sequence number
+    :param frame_number: frame number (as stored in the JTA data)
+    :param poses: all the poses of the frame (the size of the image is their `frame_size`)
+    :param visible: per-pose mask of the poses to convert, if already computed;
+        default: the poses with at least one joint not occluded
+    :return: COCO image of the frame and COCO annotations of its poses
     """
-    :param frame_data: data of the current frame
-    :param person_id: person identifier
-    :return: list of joints in the current frame with the required person ID
+    image_id = sequence * IMAGE_ID_STRIDE + frame_number
+    image = {
+        'license': 4,
+        'file_name': f'{frame_number}.jpg',
+        'height': poses.frame_size.height,
+        'width': poses.frame_size.width,
+        'date_captured': '2018-01-28 00:00:00',
+        'id': image_id
+    }
+
+    # ignore the "invisible" poses
+    # (invisible pose = pose of which I do not see any joint)
+    if visible is None:
+        visible = ~poses.invisible
+
+    annotations = poses.coco_annotations(visible)
+    for p_id, annotation in zip(poses.person_ids[visible].tolist(), annotations):
+        annotation['image_id'] = image_id
+        annotation['id'] = image_id * 100000 + p_id
+        annotation['category_id'] = 1
+
+    return image, annotations
+
+
+def coco_chunk(anno, sequence, frames, row_start, row_stop, frame_size=DEFAULT_FRAME_SIZE):
+    # type: (str, int, List[int], int, int, FrameSize) -> Tuple[List[Dict], List[Dict]]
     """
-    pose = [Joint(j) for j in frame_data[frame_data[:, 1] == person_id]]
-    pose.sort(key=(lambda j: j.type))
-    return Pose(pose)
+    Worker of `convert_sequence`: the sequence is read from its memory-mapped
+    cache (not pickled) and only rows [row_start, row_stop) are used.
 
+    :return: COCO images and annotations of the required frames
+    """
+    index = SequenceIndex(load_sequence(anno)[row_start:row_stop], frame_size=frame_size)
 
-H1 = 'path of the output directory'
+    images, annotations = [], []
+    for frame_number in frames:
+        image, frame_annotations = get_frame_coco_entries(sequence, frame_number, index.poses(frame_number))
+        images.append(image)
+        annotations += frame_annotations
 
+    return images, annotations
 
-# @click.command()
-# @click.option('--out_dir_path', type=click.Path(), prompt='Enter \'out_dir_path\'', help=H1)
-def main(folder_sequence):
+
+def coco_header(description):
+    # type: (str) -> Dict
     """
-    Script for annotation conversion (from JTA format to COCO format)
+    :param description: description of the dataset
+    :return: `info`, `licences` and `categories` of a COCO file (see `CocoWriter`)
+    """
+    return {
+        'info': {
+            'description': description,
+            'url': 'http://aimagelab.ing.unimore.it/jta',
+            'version': '1.0',
+            'year': 2018,
+            'contributor': 'AImage Lab',
+            'date_created': '2018/01/28',
+        },
+        'licences': [{
+            'url': 'http://creativecommons.org/licenses/by-nc/2.0',
+            'id': 2,
+            'name': 'Attribution-NonCommercial License'
+        }],
+        'categories': [{
+            'supercategory': 'person',
+            'id': 1,
+            'name': 'person',
+            'keypoints': Joint.NAMES,
+            'skeleton': Pose.SKELETON
+        }]
+    }
+
+
+def write_sequence(anno, writer, verbose=True, workers=1, frame_stride=1, max_frames=None, frame_size=None):
+    # type: (str, CocoWriter, bool, int, int, Optional[int], Optional[FrameSize]) -> None
+    """
+    Add the COCO images and annotations of a single sequence to `writer`;
+    only the frames with data are converted
+
+    :param anno: path of the JTA JSON of the sequence (e.g. `seq_3.json`)
+    :param writer: (open) COCO writer
+    :param verbose: if True, the conversion progress is printed
+    :param workers: number of worker processes; if > 1, ranges of frames are converted
+        in parallel and merged in frame order
+    :param frame_stride: only one frame every `frame_stride` frames is converted
+    :param max_frames: if given, at most `max_frames` frames (evenly spaced) are converted
+    :param frame_size: size of the frames; default: read from the frames (or the video)
+        in the folder of `anno` (see `sequence_frame_size`)
+
+    The time spent in each stage (load, group, pose, filter, serialize, write) is recorded
+    in the profiler of `writer`; with `workers` > 1, pose and filter run in the workers
+    and are recorded as a single 'convert' stage
     """
+    profiler = writer.profiler
 
-    # out_dir_path = Path(out_dir_path).abspath()
-    # if not out_dir_path.exists():
-    #    out_dir_path.makedirs()
+    # getting sequence number from `anno`
+    sequence = int(Path(anno).basename().split('_')[1].split('.')[0])
 
+    if frame_size is None:
+        frame_size = sequence_frame_size(Path(anno).abspath().parent)
 
+    with profiler.stage('load'):
+        data = load_sequence(anno)
 
-    for dir in Path(folder_sequence).dirs():
-        # out_subdir_path = out_dir_path / dir.basename()
-        # if not out_subdir_path.exists():
-        #    out_subdir_path.makedirs()
-        print(f'▸ converting \'{dir.basename()}\' set')
-        for anno in dir.files():
+    with profiler.stage('group'):
+        index = SequenceIndex(data, frame_size=frame_size)
+
+    frames = select_frames(index.frame_ids, frame_stride, max_frames)
+
+    if workers > 1:
+        chunks = [c.tolist() for c in np.array_split(frames, 4 * workers) if len(c) > 0]
+
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(coco_chunk, anno, sequence, chunk, *index.rows(chunk[0], chunk[-1] + 1),
+                                   frame_size)
+                       for chunk in chunks]
+
+            n_done = 0
+            for chunk, future in zip(chunks, futures):
+                with profiler.stage('convert'):
+                    images, annotations = future.result()
+                for image in images:
+                    writer.add_image(image)
+                writer.add_annotations(annotations)
 
+                profiler.count('frames', len(chunk))
+                profiler.count('annotations', len(annotations))
+                n_done += len(chunk)
+                if verbose:
+                    print(f'\r▸ progress: {100 * (n_done / len(frames)):6.2f}%', end='')
 
+    else:
+        for i, frame_number in enumerate(frames):
 
-            if anno.endswith(".json"):
+            frame_data = index.frame(frame_number)  # type: np.ndarray
 
+            with profiler.stage('pose'):
+                poses = PoseBatch(frame_data, presorted=True, frame_size=frame_size)
 
-                with open(anno, 'r') as json_file:
-                    data = json.load(json_file)
-                    data = np.array(data)
+            with profiler.stage('filter'):
+                image, annotations = get_frame_coco_entries(sequence, frame_number, poses)
 
+            writer.add_image(image)
+            writer.add_annotations(annotations)
+
+            profiler.count('frames')
+            profiler.count('annotations', len(annotations))
+
+            if verbose:
+                print(f'\r▸ progress: {100 * ((i + 1) / len(frames)):6.2f}%', end='')
+
+    if verbose:
+        print()
+
+
+def convert_sequence(anno, out_file_path, verbose=True, workers=1, frame_stride=1, max_frames=None, profiler=None,
+                     frame_size=None):
+    """
+    Annotation conversion of a single sequence (from JTA format to COCO format)
+
+    :param anno: path of the JTA JSON of the sequence (e.g. `seq_3.json`)
+    :param out_file_path: path of the output COCO JSON
+    :param verbose: if True, the conversion progress is printed
+    :param workers: number of worker processes (see `write_sequence`)
+    :param frame_stride: only one frame every `frame_stride` frames is converted
+    :param max_frames: if given, at most `max_frames` frames (evenly spaced) are converted
+    :param profiler: if given, the time spent in each stage is recorded in it (see `write_sequence`)
+    :param frame_size: size of the frames; default: read from the sequence folder (see `write_sequence`)
+    :return: path of the output COCO JSON
+    """
+    sequence = int(Path(anno).basename().split('_')[1].split('.')[0])
+
+    header = coco_header(f'JTA 2018 Dataset - Sequence #{sequence}')
+    with CocoWriter(out_file_path, **header, profiler=profiler) as writer:
+        write_sequence(anno, writer, verbose=verbose, workers=workers, frame_stride=frame_stride,
+                       max_frames=max_frames, frame_size=frame_size)
+
+    return out_file_path
+
+
+def convert_split(annos, out_file_path, split_name, verbose=True, workers=1, frame_stride=1, max_frames=None,
+                  profiler=None):
+    # type: (Sequence[str], str, str, bool, int, int, Optional[int], Optional[Profiler]) -> str
+    """
+    Annotation conversion of many sequences into a single COCO file (e.g. a train/val split);
+    sequences are streamed one at a time, so memory does not grow with the number of sequences
+
+    :param annos: paths of the JTA JSON of the sequences
+    :param out_file_path: path of the output COCO JSON
+    :param split_name: name of the split (e.g. 'train')
+    :param verbose: if True, the conversion progress is printed
+    :param workers: number of worker processes (see `write_sequence`)
+    :param frame_stride: only one frame every `frame_stride` frames is converted
+    :param max_frames: if given, at most `max_frames` frames (evenly spaced) of each sequence are converted
+    :param profiler: if given, the time spent in each stage is recorded in it (see `write_sequence`)
+    :return: path of the output COCO JSON
+    """
+    header = coco_header(f'JTA 2018 Dataset - {split_name}')
+    with CocoWriter(out_file_path, **header, profiler=profiler) as writer:
+        for anno in annos:
+            if verbose:
                 print(f'▸ converting annotations of \'{Path(anno).abspath()}\'')
+            write_sequence(anno, writer, verbose=verbose, workers=workers, frame_stride=frame_stride,
+                           max_frames=max_frames)
+
+    return out_file_path
+
+
+def merge_coco_files(coco_file_paths, out_file_path, split_name):
+    # type: (Sequence[str], str, str) -> str
+    """
+    Merge COCO files of single sequences into a single COCO file (e.g. a train/val split);
+    only one input file at a time is held in memory
+
+    :param coco_file_paths: paths of the COCO JSON of the sequences
+    :param out_file_path: path of the output COCO JSON
+    :param split_name: name of the split (e.g. 'train')
+    :return: path of the output COCO JSON
+    """
+    with CocoWriter(out_file_path, **coco_header(f'JTA 2018 Dataset - {split_name}')) as writer:
+        for coco_file_path in coco_file_paths:
+            with open(coco_file_path, 'r') as f:
+                coco_dict = json.load(f)
+            for image in coco_dict['images']:
+                writer.add_image(image)
+            writer.add_annotations(coco_dict['annotations'])
+
+    return out_file_path
+
+
+# @click.command()
+# @click.option('--out_dir_path', type=click.Path(), prompt='Enter \'out_dir_path\'', help=H1)
+def main(folder_sequence):
+    """
+    Script for annotation conversion (from JTA format to COCO format)
+    """
+
+    for dir in Path(folder_sequence).dirs():
+        print(f'▸ converting \'{dir.basename()}\' set')
+        for anno in dir.files():
+
+            # getting sequence number from `anno`
+            match = SEQUENCE_JSON_PATTERN.fullmatch(Path(anno).basename())
+            if match is None:
+                continue
+            sequence = int(match.group(1))
+
+            out_file_path = os.path.join(dir, f'seq_{sequence}.coco.json')
+
+            if os.path.isfile(out_file_path):
+                continue
 
-                # getting sequence number from `anno`
-                sequence = None
-                try:
-                    sequence = int(Path(anno).basename().split('_')[1].split('.')[0])
-                except:
-                    print('[!] error during conversion.')
-                    print('\ttry using JSON files with the original nomenclature.')
-
-                out_file_path = os.path.join(dir, f'seq_{sequence}.coco.json')
-
-                if os.path.isfile(out_file_path):
-                    continue
-
-                coco_dict = {
-                    'info': {
-                        'description': f'JTA 2018 Dataset - Sequence #{sequence}',
-                        'url': 'http://aimagelab.ing.unimore.it/jta',
-                        'version': '1.0',
-                        'year': 2018,
-                        'contributor': 'AImage Lab',
-                        'date_created': '2018/01/28',
-                    },
-                    'licences': [{
-                        'url': 'http://creativecommons.org/licenses/by-nc/2.0',
-                        'id': 2,
-                        'name': 'Attribution-NonCommercial License'
-                    }],
-                    'images': [],
-                    'annotations': [],
-                    'categories': [{
-                        'supercategory': 'person',
-                        'id': 1,
-                        'name': 'person',
-                        'keypoints': Joint.NAMES,
-                        'skeleton': Pose.SKELETON
-                    }]
-                }
-
-                for frame_number in range(0, 900):
-
-                    image_id = sequence * 1000 + (frame_number + 1)
-                    coco_dict['images'].append({
-                        'license': 4,
-                        'file_name': f'{frame_number + 1}.jpg',
-                        'height': 1080,
-                        'width': 1920,
-                        'date_captured': '2018-01-28 00:00:00',
-                        'id': image_id
-                    })
-
-                    # NOTE: frame #0 does NOT exists: first frame is #1
-                    frame_data = data[data[:, 0] == frame_number + 1]  # type: np.ndarray
-
-                    for p_id in set(frame_data[:, 1]):
-                        pose = get_pose(frame_data=frame_data, person_id=p_id)
-
-                        # ignore the "invisible" poses
-                        # (invisible pose = pose of which I do not see any joint)
-                        if pose.invisible:
-                            continue
-
-                        annotation = pose.coco_annotation
-                        annotation['image_id'] = image_id
-                        annotation['id'] = image_id * 100000 + int(p_id)
-                        annotation['category_id'] = 1
-                        coco_dict['annotations'].append(annotation)
-
-                    print(f'\r▸ progress: {100 * (frame_number / 899):6.2f}%', end='')
-
-                print()
-
-
-
-                with open(out_file_path, 'w') as f:
-                    json.dump(coco_dict, f)
+            print(f'▸ converting annotations of \'{Path(anno).abspath()}\'')
+            convert_sequence(anno, out_file_path)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+# ---------------------
+
+import json
+import os
+import shutil
+import tempfile
+from typing import *
+
+from utils.profiling import Profiler
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dumps(obj):
+    # type: (Any) -> str
+    """
+    :return: JSON string of `obj`; `orjson` is used when available
+    """
+    if orjson is not None:
+        return orjson.dumps(obj).decode('utf-8')
+    return json.dumps(obj)
+
+
+class CocoWriter(object):
+    """
+    Streaming writer of a COCO JSON file: images and annotations are written
+    one by one (annotations are spooled to a temporary file, since they follow
+    all the images), so memory does not depend on the size of the dataset.
+    The output is moved in place only when the writer is closed without errors.
+    If a profiler is given, the time spent serializing and writing entries is
+    recorded in its 'serialize' and 'write' stages.
+    """
+
+    def __init__(self, file_path, info, licences, categories, profiler=None):
+        # type: (str, Dict, List[Dict], List[Dict], Optional[Profiler]) -> None
+        self.file_path = file_path
+        self.profiler = Profiler('coco') if profiler is None else profiler
+        self.info = info
+        self.licences = licences
+        self.categories = categories
+        self.n_images = 0
+        self.n_annotations = 0
+        self._file = None
+        self._spool = None
+
+    def __enter__(self):
+        folder = os.path.dirname(os.path.abspath(self.file_path))
+        self._file = open(self.file_path + '.tmp', 'w')
+        self._spool = tempfile.TemporaryFile('w+', dir=folder)
+
+        self._file.write(f'{{"info": {dumps(self.info)}, "licences": {dumps(self.licences)}, "images": [')
+        return self
+
+    def add_image(self, image):
+        # type: (Dict) -> None
+        with self.profiler.stage('serialize'):
+            text = (', ' if self.n_images > 0 else '') + dumps(image)
+        with self.profiler.stage('write'):
+            self._file.write(text)
+        self.n_images += 1
+
+    def add_annotation(self, annotation):
+        # type: (Dict) -> None
+        self.add_annotations([annotation])
+
+    def add_annotations(self, annotations):
+        # type: (Sequence[Dict]) -> None
+        if len(annotations) == 0:
+            return
+        with self.profiler.stage('serialize'):
+            text = ', '.join(dumps(a) for a in annotations)
+            if self.n_annotations > 0:
+                text = ', ' + text
+        with self.profiler.stage('write'):
+            self._spool.write(text)
+        self.n_annotations += len(annotations)
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        try:
+            if exc_type is None:
+                with self.profiler.stage('write'):
+                    self._file.write('], "annotations": [')
+                    self._spool.seek(0)
+                    shutil.copyfileobj(self._spool, self._file)
+                    self._file.write(f'], "categories": {dumps(self.categories)}}}')
+        finally:
+            self._spool.close()
+            self._file.close()
+
+        if exc_type is None:
+            os.replace(self.file_path + '.tmp', self.file_path)
+        else:
+            os.remove(self.file_path + '.tmp')
@@ -0,0 +1,410 @@
+# -*- coding: utf-8 -*-
+# ---------------------
+
+import csv
+import os
+from contextlib import ExitStack
+from typing import *
+
+import numpy as np
+from path import Path
+
+from utils import CVAT_style
+from utils.ann_visualization.pose_batch import PoseBatch
+from utils.coco_style_convert import coco_header, get_frame_coco_entries
+from utils.coco_writer import CocoWriter
+from utils.geometry import FrameSize, sequence_frame_size
+from utils.profiling import Profiler
+from utils.sequence_cache import load_sequence
+from utils.sequence_index import SequenceIndex, select_frames
+
+
+class FramePoses(object):
+    """
+    all the poses of a frame, with the pose-level attributes shared by the sinks
+    of `export_sequence`, computed once for all of them
+    """
+
+    def __init__(self, frame_number, poses):
+        # type: (int, PoseBatch) -> None
+        """
+        :param frame_number: frame number
+        :param poses: all the poses of the frame; NOTE: their joints that are not on screen
+            are marked as occluded (see `PoseBatch.handle_joints_not_on_screen`)
+        """
+        self.frame_number = frame_number
+        self.poses = poses
+        self.frame_size = poses.frame_size
+
+        self.person_ids = poses.person_ids
+        self.bbox = poses.bbox_2d
+        self.bbox_padded = poses.bbox_2d_padded(CVAT_style.BBOX_H_INC_PERC, CVAT_style.BBOX_W_INC_PERC)
+
+        # True if all the joints are occluded (joints out of screen count as visible)
+        self.invisible = poses.invisible
+
+        # the remaining masks count the joints out of screen as occluded
+        poses.handle_joints_not_on_screen()
+        self.n_occluded = poses.n_occluded
+        self.head_not_visible = poses.head_not_visible
+        self.half_not_visible = self.n_occluded >= (poses.counts // 2)
+        self.visible_enough = ~(self.head_not_visible | self.half_not_visible | (self.n_occluded == poses.counts))
+
+        # fraction of visible joints of each pose
+        self.visibility = 1 - self.n_occluded / np.maximum(poses.counts, 1)
+
+        # padded boxes (clipped to the frame) of the poses that are visible enough, as in the CVAT export
+        self.boxes = CVAT_style.normalize_bboxes(self.bbox_padded[self.visible_enough], self.frame_size)
+
+    def __len__(self):
+        # type: () -> int
+        return len(self.poses)
+
+
+class Sink(object):
+    """
+    an output format of `export_sequence`: it is opened once per sequence,
+    receives every frame with data (in order; frames missing from the JTA data
+    are skipped) and is closed at the end of the sequence, also when the export fails
+    """
+
+    name = 'sink'
+
+    def open(self, sequence, index):
+        # type: (int, SequenceIndex) -> None
+        """
+        :param sequence: sequence number
+        :param index: index of the whole sequence
+        """
+        pass
+
+    def add_frame(self, frame):
+        # type: (FramePoses) -> None
+        raise NotImplementedError
+
+    def close(self, exc_type=None, exc_val=None, exc_tb=None):
+        # type: (Optional[type], Optional[BaseException], Any) -> None
+        """
+        :param exc_type: type of the exception that stopped the export (None on success)
+        """
+        pass
+
+
+class CVATSink(Sink):
+    """
+    CVAT XML (see `CVAT_style.json_imavis_style_conversion`): one <image> node per frame,
+    with a padded box for each pose that is visible enough; frames missing from the
+    JTA data get an empty <image> node, as in the CVAT conversion
+    """
+
+    name = 'cvat'
+
+    def __init__(self, out_file_path):
+        # type: (str) -> None
+        self.out_file_path = out_file_path
+        self._writer = None  # type: Optional[CVAT_style.CVATWriter]
+        self._next_frame = 0
+
+    def open(self, sequence, index):
+        self._writer = CVAT_style.CVATWriter(self.out_file_path).__enter__()
+        self._writer.append(CVAT_style.create_meta_xml(index.n_frames))
+        self._next_frame = 0
+
+    def add_frame(self, frame):
+        no_boxes = np.zeros((0, 4))
+        for frame_number in range(self._next_frame, frame.frame_number):
+            self._writer.append(CVAT_style.get_boxes_image_node(frame_number, no_boxes, frame.frame_size))
+
+        boxes = frame.bbox_padded[frame.visible_enough]
+        self._writer.append(CVAT_style.get_boxes_image_node(frame.frame_number, boxes, frame.frame_size))
+        self._next_frame = frame.frame_number + 1
+
+    def close(self, exc_type=None, exc_val=None, exc_tb=None):
+        if self._writer is not None:
+            self._writer.__exit__(exc_type, exc_val, exc_tb)
+            self._writer = None
+
+
+class CocoSink(Sink):
+    """
+    COCO JSON (see `coco_style_convert.convert_sequence`): one image per frame with data,
+    with an annotation for each pose that is not completely occluded
+    """
+
+    name = 'coco'
+
+    def __init__(self, out_file_path, frame_stride=1, max_frames=None):
+        # type: (str, int, Optional[int]) -> None
+        """
+        :param out_file_path: path of the output COCO JSON
+        :param frame_stride: only one frame every `frame_stride` frames (with data) is converted
+        :param max_frames: if given, at most `max_frames` frames (evenly spaced) are converted
+        """
+        self.out_file_path = out_file_path
+        self.frame_stride = frame_stride
+        self.max_frames = max_frames
+        self._sequence = None  # type: Optional[int]
+        self._frames = set()  # type: Set[int]
+        self._writer = None  # type: Optional[CocoWriter]
+
+    def open(self, sequence, index):
+        self._sequence = sequence
+        self._frames = set(select_frames(index.frame_ids, self.frame_stride, self.max_frames))
+        header = coco_header(f'JTA 2018 Dataset - Sequence #{sequence}')
+        self._writer = CocoWriter(self.out_file_path, **header).__enter__()
+
+    def add_frame(self, frame):
+        if frame.frame_number not in self._frames:
+            return
+        image, annotations = get_frame_coco_entries(self._sequence, frame.frame_number, frame.poses,
+                                                    visible=~frame.invisible)
+        self._writer.add_image(image)
+        self._writer.add_annotations(annotations)
+
+    def close(self, exc_type=None, exc_val=None, exc_tb=None):
+        if self._writer is not None:
+            self._writer.__exit__(exc_type, exc_val, exc_tb)
+            self._writer = None
+
+
+class BBoxSummarySink(Sink):
+    """
+    CSV summary with one row per pose: its box, padded box and visibility flags
+    """
+
+    name = 'bbox'
+
+    COLUMNS = ['frame', 'pedestrian_id', 'x_min', 'y_min', 'x_max', 'y_max',
+               'x_min_pad', 'y_min_pad', 'x_max_pad', 'y_max_pad',
+               'n_joints', 'n_occluded', 'invisible', 'head_not_visible', 'half_not_visible', 'visible_enough']
+
+    def __init__(self, out_file_path):
+        # type: (str) -> None
+        self.out_file_path = out_file_path
+        self._file = None
+        self._writer = None
+
+    def open(self, sequence, index):
+        self._file = open(self.out_file_path + '.tmp', 'w', newline='')
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(BBoxSummarySink.COLUMNS)
+
+    def add_frame(self, frame):
+        if len(frame) == 0:
+            return
+        padded = np.round(frame.bbox_padded, 2)
+        columns = [
+            np.full(len(frame), frame.frame_number), frame.person_ids, *frame.bbox.T, *padded.T,
+            frame.poses.counts, frame.n_occluded,
+            frame.invisible.astype(int), frame.head_not_visible.astype(int),
+            frame.half_not_visible.astype(int), frame.visible_enough.astype(int),
+        ]
+        self._writer.writerows(zip(*[c.tolist() for c in columns]))
+
+    def close(self, exc_type=None, exc_val=None, exc_tb=None):
+        if self._file is None:
+            return
+        self._file.close()
+        self._file = None
+        if exc_type is None:
+            os.replace(self.out_file_path + '.tmp', self.out_file_path)
+        else:
+            os.remove(self.out_file_path + '.tmp')
+
+
+class YoloSink(Sink):
+    """
+    YOLO labels: one `<class> <cx> <cy> <w> <h>` row (normalized to the frame size)
+    for each box of the CVAT export; either one `<frame>.txt` file per frame
+    (as the `<frame>.jpg` frames, only for the frames with data), or a single file
+    with the frame name in front of every row
+    """
+
+    name = 'yolo'
+
+    # class of the pedestrians
+    CLASS_ID = 0
+
+    def __init__(self, out_file_path, per_frame=True):
+        # type: (str, bool) -> None
+        """
+        :param out_file_path: output folder (if `per_frame`) or output file
+        :param per_frame: if True, one label file per frame is written in `out_file_path`
+        """
+        self.out_file_path = out_file_path
+        self.per_frame = per_frame
+        self._file = None
+
+    def open(self, sequence, index):
+        if self.per_frame:
+            os.makedirs(self.out_file_path, exist_ok=True)
+        else:
+            os.makedirs(os.path.dirname(os.path.abspath(self.out_file_path)), exist_ok=True)
+            self._file = open(self.out_file_path + '.tmp', 'w')
+
+    def add_frame(self, frame):
+        boxes = frame.boxes
+        size = np.array(frame.frame_size, dtype=np.float64)
+        centers = (boxes[:, :2] + boxes[:, 2:]) / 2 / size
+        sizes = (boxes[:, 2:] - boxes[:, :2]) / size
+        rows = np.concatenate([centers, sizes], axis=1)
+
+        prefix = '' if self.per_frame else f'{frame.frame_number}.jpg '
+        lines = ''.join(f'{prefix}{YoloSink.CLASS_ID} {cx:.6f} {cy:.6f} {w:.6f} {h:.6f}\n'
+                        for cx, cy, w, h in rows.tolist())
+
+        if self.per_frame:
+            # frames without boxes get an empty label file (negative samples)
+            with open(os.path.join(self.out_file_path, f'{frame.frame_number}.txt'), 'w') as f:
+                f.write(lines)
+        else:
+            self._file.write(lines)
+
+    def close(self, exc_type=None, exc_val=None, exc_tb=None):
+        if self._file is None:
+            return
+        self._file.close()
+        self._file = None
+        if exc_type is None:
+            os.replace(self.out_file_path + '.tmp', self.out_file_path)
+        else:
+            os.remove(self.out_file_path + '.tmp')
+
+
+class MOTSink(Sink):
+    """
+    MOTChallenge ground truth (`gt.txt`): one
+    `<frame>,<id>,<bb_left>,<bb_top>,<bb_width>,<bb_height>,<conf>,<class>,<visibility>` row
+    for each box of the CVAT export; MOTChallenge frames are 1-based, while JTA frames start at 0,
+    so the rows of frame `<n>.jpg` have frame n + 1
+    """
+
+    name = 'mot'
+
+    # class of the pedestrians in MOTChallenge
+    CLASS_ID = 1
+
+    def __init__(self, out_file_path):
+        # type: (str) -> None
+        self.out_file_path = out_file_path
+        self._file = None
+
+    def open(self, sequence, index):
+        os.makedirs(os.path.dirname(os.path.abspath(self.out_file_path)), exist_ok=True)
+        self._file = open(self.out_file_path + '.tmp', 'w')
+
+    def add_frame(self, frame):
+        boxes = frame.boxes
+        if len(boxes) == 0:
+            return
+        ids = frame.person_ids[frame.visible_enough].tolist()
+        visibility = frame.visibility[frame.visible_enough].tolist()
+        for p_id, (x_min, y_min, x_max, y_max), vis in zip(ids, boxes.tolist(), visibility):
+            self._file.write(f'{frame.frame_number + 1},{p_id},{x_min:.2f},{y_min:.2f},'
+                             f'{x_max - x_min:.2f},{y_max - y_min:.2f},1,{MOTSink.CLASS_ID},{vis:.4f}\n')
+
+    def close(self, exc_type=None, exc_val=None, exc_tb=None):
+        if self._file is None:
+            return
+        self._file.close()
+        self._file = None
+        if exc_type is None:
+            os.replace(self.out_file_path + '.tmp', self.out_file_path)
+        else:
+            os.remove(self.out_file_path + '.tmp')
+
+
+def export_sequence(json_file_path, sinks, verbose=True, profiler=None, frame_size=None):
+    # type: (str, Sequence[Sink], bool, Optional[Profiler], Optional[FrameSize]) -> None
+    """
+    Export a sequence to many formats in a single pass: the JTA JSON is loaded
+    and grouped once, and the pose-level attributes of every frame (boxes,
+    visibility, ...) are computed once and shared by all the sinks
+
+    :param json_file_path: path of the JTA JSON of the sequence (e.g. `seq_3.json`)
+    :param sinks: output formats (e.g. `[CVATSink(...), CocoSink(...)]`)
+    :param verbose: if True, the conversion progress is printed
+    :param profiler: if given, the time spent loading, grouping, building the poses,
+        computing their attributes and in each sink is recorded in it
+    :param frame_size: size of the frames; default: read from the frames (or the video)
+        in the folder of `json_file_path` (see `sequence_frame_size`)
+    """
+    profiler = Profiler('export') if profiler is None else profiler
+
+    if frame_size is None:
+        frame_size = sequence_frame_size(Path(json_file_path).abspath().parent)
+
+    sequence = int(Path(json_file_path).basename().split('_')[1].split('.')[0])
+
+    with profiler.stage('load'):
+        data = load_sequence(json_file_path)
+
+    with profiler.stage('group'):
+        index = SequenceIndex(data, frame_size=frame_size)
+    n_frames = len(index)
+
+    with ExitStack() as stack:
+        for sink in sinks:
+            sink.open(sequence, index)
+            stack.push(sink.close)
+
+        # only the frames with data: no empty labels for the frames missing from the JTA data
+        for n_done, (frame_number, frame_data) in enumerate(index, 1):
+            with profiler.stage('pose'):
+                poses = PoseBatch(frame_data, presorted=True, frame_size=frame_size)
+
+            with profiler.stage('filter'):
+                frame = FramePoses(frame_number, poses)
+
+            for sink in sinks:
+                with profiler.stage(sink.name):
+                    sink.add_frame(frame)
+
+            profiler.count('frames')
+            if verbose:
+                print(f'\r▸ seq_{sequence} export progress: {100 * (n_done / n_frames):6.2f}%', end='')
+
+    if verbose:
+        print()
+
+
+# formats of `make_sinks`: name -> path of the output (file or folder), relative to the output folder,
+# given the sequence name (e.g. 'seq_3')
+EXPORT_FORMATS = {
+    'cvat': '{}_CVAT.xml',
+    'coco': '{}.coco.json',
+    'bbox': '{}_bboxes.csv',
+    'yolo': 'labels',
+    'yolo_txt': '{}_yolo.txt',
+    'mot': os.path.join('gt', 'gt.txt'),
+}
+
+
+def make_sinks(formats, json_file_path, out_folder=None):
+    # type: (Sequence[str], str, Optional[str]) -> List[Sink]
+    """
+    :param formats: names of the output formats (keys of `EXPORT_FORMATS`)
+    :param json_file_path: path of the JTA JSON of the sequence (e.g. `seq_3.json`)
+    :param out_folder: folder of the outputs; default: the folder of `json_file_path`
+    :return: one sink per format, writing `<out_folder>/<EXPORT_FORMATS[format]>`
+    """
+    seq_name = Path(json_file_path).basename().stripext()
+    out_folder = Path(json_file_path).abspath().parent if out_folder is None else out_folder
+    os.makedirs(out_folder, exist_ok=True)
+
+    sinks = []
+    for fmt in formats:
+        if fmt not in EXPORT_FORMATS:
+            raise ValueError(f'unknown export format \'{fmt}\'')
+        out_file_path = os.path.join(out_folder, EXPORT_FORMATS[fmt].format(seq_name))
+        if fmt == 'cvat':
+            sinks.append(CVATSink(out_file_path))
+        elif fmt == 'coco':
+            sinks.append(CocoSink(out_file_path))
+        elif fmt == 'bbox':
+            sinks.append(BBoxSummarySink(out_file_path))
+        elif fmt in ('yolo', 'yolo_txt'):
+            sinks.append(YoloSink(out_file_path, per_frame=(fmt == 'yolo')))
+        elif fmt == 'mot':
+            sinks.append(MOTSink(out_file_path))
+    return sinks
@@ -1,7 +1,17 @@
 import os
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 import cv2
 
+from utils.geometry import IMAGE_EXTENSIONS, sequence_frame_size
+from utils.profiling import Profiler
+
+# end of the frames, for the writer thread of `frames_to_video`
+_DONE = object()
+
 
 def sort_by_filename_number(e):
     return int(e.split(os.sep)[-1].split("-")[0].split(".")[0])
@@ -12,9 +22,8 @@ def get_file_folder_list(video_folder):
     for root, dirs, files in os.walk(video_folder):
         for file in files:
 
-            if file.endswith(".csv") or file.endswith(".txt") or file.endswith(".mp4"):
-                continue
-            else:
+            # only the frames: annotations, caches and videos live in the same folder
+            if file.lower().endswith(IMAGE_EXTENSIONS):
                 video_path_list.append(os.path.join(root, file))
 
     video_path_list.sort(key=sort_by_filename_number)
@@ -22,29 +31,130 @@ def get_file_folder_list(video_folder):
     return video_path_list
 
 
-if __name__ == "__main__":
-
-    for i in range(16, 18):
-
-        seq_path = f"C:\\Users\\simoc\\Desktop\\Synthetic Data IMAVIS\\seq_{i}"
+def read_frame(path):
+    """
+    :param path: path of the frame
+    :return: the decoded frame (BGR)
+    :raises IOError: if the frame cannot be read
+    """
+    frame = cv2.imread(path)
+    if frame is None:
+        raise IOError(f'[!] cannot read frame \'{path}\'')
+    return frame
+
+
+def iter_frames(paths, decoders=4, prefetch=16, profiler=None):
+    """
+    Decode the frames with a pool of threads (cv2 releases the GIL while decoding);
+    a frame that cannot be read raises `IOError` (see `read_frame`)
+
+    :param paths: paths of the frames, in order
+    :param decoders: number of decoding threads
+    :param prefetch: maximum number of frames decoded ahead
+    :param profiler: if given, the decoding time (summed over the threads) is recorded in its 'decode' stage
+    :return: iterator over the decoded frames, in the order of `paths`
+    """
+    profiler = Profiler('decode') if profiler is None else profiler
+    imread = profiler.timed('decode')(read_frame)
+
+    with ThreadPoolExecutor(max_workers=decoders) as pool:
+        pending = deque()
+        for path in paths:
+            pending.append(pool.submit(imread, path))
+            if len(pending) >= prefetch:
+                yield pending.popleft().result()
+
+        while pending:
+            yield pending.popleft().result()
+
+
+def frames_to_video(seq_path, out_path, fps_video=20, width=None, height=None, show=True, decoders=4, prefetch=16,
+                    profiler=None):
+    """
+    Encode the numbered frames of a sequence folder into a video; decoding (pool of threads)
+    and encoding (dedicated writer thread) overlap through a bounded queue
+
+    :param seq_path: sequence folder containing the frames
+    :param out_path: path of the output video
+    :param fps_video: frame rate of the output video
+    :param width: width of the output video; default: the width of the frames
+    :param height: height of the output video; default: the height of the frames
+    :param show: if True, each frame is also displayed (press `q` to stop)
+    :param decoders: number of decoding threads
+    :param prefetch: maximum number of frames decoded ahead (and waiting to be encoded)
+    :param profiler: if given, the time spent in each stage (list, decode, encode) is recorded in it;
+        the stages overlap, so their sum can exceed the wall time
+    :return: path of the output video
+    :raises FileNotFoundError: if the folder contains no frames
+    :raises IOError: if a frame cannot be read; the partial video is removed
+    """
+    profiler = Profiler('video') if profiler is None else profiler
+
+    with profiler.stage('list'):
+        paths = get_file_folder_list(seq_path)
+    if len(paths) == 0:
+        raise FileNotFoundError(f'[!] no frames in \'{seq_path}\'')
+
+    if width is None or height is None:
+        frame_size = sequence_frame_size(seq_path)
+        width = frame_size.width if width is None else width
+        height = frame_size.height if height is None else height
+
+    fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+
+    out_video = cv2.VideoWriter(out_path, fourcc, fps_video, (width, height))
+
+    to_write = queue.Queue(maxsize=prefetch)
+    errors = []
+
+    def writer():
+        while True:
+            frame = to_write.get()
+            if frame is _DONE:
+                break
+            try:
+                with profiler.stage('encode'):
+                    out_video.write(frame)
+            except Exception as e:
+                # keep draining the queue so that the producer never blocks
+                errors.append(e)
+
+    writer_thread = threading.Thread(target=writer, daemon=True)
+    writer_thread.start()
+
+    completed = False
+    try:
+        for frame in iter_frames(paths, decoders=decoders, prefetch=prefetch, profiler=profiler):
+
+            to_write.put(frame)
+            profiler.count('frames')
+
+            if show:
+                cv2.imshow("Display_Image", frame)
+
+                if cv2.waitKey(1) & 0xFF == ord('q'):
+                    break
+        completed = True
+    finally:
+        to_write.put(_DONE)
+        writer_thread.join()
+        out_video.release()
+        if show:
+            cv2.destroyAllWindows()
+        if not completed and os.path.isfile(out_path):
+            # never leave a truncated video behind
+            os.remove(out_path)
 
-        width = 1920
-        height = 1080
-        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-        fps_video = 20
+    if errors:
+        raise errors[0]
 
-        out_video = cv2.VideoWriter(os.path.join(seq_path, f"seq_{i}.mp4"), fourcc, fps_video, (width, height))
-        seq_path = get_file_folder_list(seq_path)
+    return out_path
 
-        for path in seq_path:
 
-            frame = cv2.imread(path)
-            out_video.write(frame)
+if __name__ == "__main__":
 
-            cv2.imshow("Display_Image", frame)
+    for i in range(16, 18):
 
-            if cv2.waitKey(1) & 0xFF == ord('q'):
-                break
+        seq_path = f"C:\\Users\\simoc\\Desktop\\Synthetic Data IMAVIS\\seq_{i}"
 
-        out_video.release()
-        cv2.destroyAllWindows()
+        frames_to_video(seq_path, os.path.join(seq_path, f"seq_{i}.mp4"))
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+# ---------------------
+
+import json
+import os
+from collections import namedtuple
+from typing import *
+
+import numpy as np
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+# camera of a reprojected sequence, written by `utils.projection.reproject_json` in the folder
+# of the reprojected sequence (never in the folder of the original one)
+CAMERA_FILE_NAME = 'camera.json'
+
+
+class FrameSize(namedtuple('FrameSize', ['width', 'height'])):
+    """
+    size [px] of the frames of a sequence; on-screen tests and clipping
+    are vectorized, so they work on scalars as well as on arrays of joints/boxes
+    """
+
+    __slots__ = ()
+
+    def on_screen(self, x, y):
+        # type: (Union[int, np.ndarray], Union[int, np.ndarray]) -> Union[bool, np.ndarray]
+        """
+        :return: True (or per-element mask) if the point(s) (x, y) are inside the frame (borders included)
+        """
+        return (0 <= x) & (x <= self.width) & (0 <= y) & (y <= self.height)
+
+    def clip_boxes(self, boxes):
+        # type: (np.ndarray) -> np.ndarray
+        """
+        :param boxes: (n, 4) array of boxes in format [x_min, y_min, x_max, y_max]
+        :return: boxes clipped to the frame
+        """
+        return np.clip(boxes, 0, [self.width, self.height, self.width, self.height])
+
+
+# size of the frames of the JTA dataset
+DEFAULT_FRAME_SIZE = FrameSize(1920, 1080)
+
+
+def frame_size_of_image(image_path):
+    # type: (str) -> Optional[FrameSize]
+    """
+    :return: size of the image, or None if it cannot be read
+    """
+    import cv2
+
+    image = cv2.imread(image_path, cv2.IMREAD_UNCHANGED)
+    if image is None:
+        return None
+    return FrameSize(image.shape[1], image.shape[0])
+
+
+def frame_size_of_video(video_path):
+    # type: (str) -> Optional[FrameSize]
+    """
+    :return: size of the frames of the video, or None if it cannot be read
+    """
+    import cv2
+
+    capture = cv2.VideoCapture(video_path)
+    try:
+        width = int(capture.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    finally:
+        capture.release()
+    return FrameSize(width, height) if width > 0 and height > 0 else None
+
+
+def sequence_frame_size(seq_dir, default=DEFAULT_FRAME_SIZE):
+    # type: (str, FrameSize) -> FrameSize
+    """
+    Size of the frames of a sequence folder, read from (in order of preference)
+    one of its frames (`<n>.jpg`, ...), its video (`<seq_name>.mp4`) or, for reprojected
+    sequences, its camera (`CAMERA_FILE_NAME`, see `utils.projection.reproject_json`)
+
+    :param seq_dir: sequence folder
+    :param default: size returned if neither the frames, the video nor the camera can be read
+    :return: size of the frames of the sequence
+    """
+    if os.path.isdir(seq_dir):
+        with os.scandir(seq_dir) as entries:
+            for entry in entries:
+                if entry.is_file() and entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                    frame_size = frame_size_of_image(entry.path)
+                    if frame_size is not None:
+                        return frame_size
+                    break
+
+    video_path = os.path.join(seq_dir, f'{os.path.basename(os.path.normpath(seq_dir))}.mp4')
+    if os.path.isfile(video_path):
+        frame_size = frame_size_of_video(video_path)
+        if frame_size is not None:
+            return frame_size
+
+    camera_path = os.path.join(seq_dir, CAMERA_FILE_NAME)
+    if os.path.isfile(camera_path):
+        with open(camera_path, 'r') as f:
+            camera = json.load(f)
+        return FrameSize(int(camera['width']), int(camera['height']))
+
+    return default
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+# ---------------------
+
+import hashlib
+import json
+import os
+from typing import *
+
+from utils.geometry import IMAGE_EXTENSIONS
+
+# bump when the content of any derived artifact changes, to rebuild them all
+TOOL_VERSION = '1.0'
+
+MANIFEST_NAME = 'manifest.json'
+
+
+def file_sha1(path, block_size=1 << 20):
+    # type: (str, int) -> str
+    """
+    :return: SHA-1 hex digest of the file content
+    """
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+def fingerprint(path, hash_files=False):
+    # type: (str, bool) -> Dict
+    """
+    :param path: path of a file, or of a folder (e.g. the frames of a sequence)
+    :param hash_files: if True, the SHA-1 of the content is included (files only)
+    :return: fingerprint of the current version of `path`; folders are summarized by number,
+        total size and most recent mtime of their frames (the other files are ignored)
+    """
+    if os.path.isdir(path):
+        n_files, size, mtime_ns = 0, 0, 0
+        for entry in os.scandir(path):
+            if entry.is_file() and entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                stat = entry.stat()
+                n_files += 1
+                size += stat.st_size
+                mtime_ns = max(mtime_ns, stat.st_mtime_ns)
+        return {'n_files': n_files, 'size': size, 'mtime_ns': mtime_ns}
+
+    stat = os.stat(path)
+    result = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+    if hash_files:
+        result['sha1'] = file_sha1(path)
+    return result
+
+
+def same_fingerprint(old, new):
+    # type: (Dict, Dict) -> bool
+    """
+    :return: True if the two fingerprints refer to the same content;
+        content hashes win over mtimes when both fingerprints have them
+    """
+    if 'sha1' in old and 'sha1' in new:
+        return old['sha1'] == new['sha1'] and old['size'] == new['size']
+    return all(old.get(k) == v for k, v in new.items() if k != 'sha1')
+
+
+class Manifest(object):
+    """
+    a Manifest records, for every artifact derived from a sequence folder
+    (JTA JSON, CVAT XML, COCO JSON, MP4, ...), the fingerprints of its inputs,
+    its parameters and the tool version; an artifact is rebuilt only if any
+    of them changed (or if its output is missing).
+    """
+
+    def __init__(self, seq_dir, hash_files=False):
+        # type: (str, bool) -> None
+        """
+        :param seq_dir: sequence folder; the manifest is `<seq_dir>/manifest.json`
+        :param hash_files: if True, input files are also compared by content hash
+        """
+        self.seq_dir = seq_dir
+        self.path = os.path.join(seq_dir, MANIFEST_NAME)
+        self.hash_files = hash_files
+
+        self.artifacts = {}  # type: Dict[str, Dict]
+        if os.path.isfile(self.path):
+            with open(self.path, 'r') as f:
+                try:
+                    self.artifacts = json.load(f).get('artifacts', {})
+                except ValueError:
+                    self.artifacts = {}
+
+    def _rel(self, path):
+        # type: (str) -> str
+        return os.path.relpath(path, self.seq_dir)
+
+    def fingerprints(self, inputs):
+        # type: (Sequence[str]) -> Dict[str, Dict]
+        """
+        :return: current fingerprints of the inputs, keyed on their path relative to the sequence folder
+        """
+        return {self._rel(p): fingerprint(p, self.hash_files) for p in inputs}
+
+    def is_stale(self, artifact, output, inputs, params):
+        # type: (str, str, Sequence[str], Dict) -> bool
+        """
+        :param artifact: artifact name (e.g. 'cvat')
+        :param output: path of the artifact
+        :param inputs: paths of the files/folders the artifact is derived from
+        :param params: parameters used to build the artifact (must be JSON serializable)
+        :return: True if the artifact must be (re)built
+        """
+        entry = self.artifacts.get(artifact)
+        if entry is None or not os.path.exists(output):
+            return True
+        if entry.get('tool_version') != TOOL_VERSION or entry.get('output') != self._rel(output):
+            return True
+        if entry.get('params') != json.loads(json.dumps(params)):
+            return True
+
+        old_inputs = entry.get('inputs', {})
+        if set(old_inputs) != {self._rel(p) for p in inputs}:
+            return True
+        for path in inputs:
+            if not os.path.exists(path):
+                return True
+            if not same_fingerprint(old_inputs[self._rel(path)], fingerprint(path, self.hash_files)):
+                return True
+
+        return False
+
+    def record(self, artifact, output, input_fingerprints, params):
+        # type: (str, str, Dict[str, Dict], Dict) -> None
+        """
+        Record a (re)built artifact and save the manifest
+
+        :param input_fingerprints: fingerprints of the inputs taken *before* building the artifact
+            (see `fingerprints`)
+        """
+        self.artifacts[artifact] = {
+            'output': self._rel(output),
+            'inputs': input_fingerprints,
+            'params': json.loads(json.dumps(params)),
+            'tool_version': TOOL_VERSION,
+        }
+        self.save()
+
+    def save(self):
+        # type: () -> None
+        with open(self.path + '.tmp', 'w') as f:
+            json.dump({'artifacts': self.artifacts}, f, indent=2, sort_keys=True)
+        os.replace(self.path + '.tmp', self.path)
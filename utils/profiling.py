@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+# ---------------------
+
+import cProfile
+import functools
+import io
+import json
+import pstats
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import *
+
+# number of functions (sorted by cumulative time) kept in the cProfile section of a report
+PROFILE_TOP_N = 30
+
+
+class Profiler(object):
+    """
+    Lightweight instrumentation of a conversion run: wall time spent in each
+    named stage (e.g. 'load', 'serialize', 'encode') and counters (e.g. 'frames').
+    Stages can be timed from different threads (e.g. decoding and encoding
+    threads of `visualize`); their times are summed, so they can exceed the
+    wall time of the run when stages overlap.
+
+    Optionally (opt-in, as they slow down the run) a `cProfile` profile
+    of the thread that enters the profiler and the peak memory traced
+    by `tracemalloc` are added to the report.
+
+    >>> profiler = Profiler('cvat')
+    >>> with profiler:
+    ...     with profiler.stage('load'):
+    ...         data = ...
+    ...     profiler.count('frames', 1800)
+    >>> profiler.save('report.json')
+    """
+
+    def __init__(self, name='run', profile=False, trace_memory=False):
+        # type: (str, bool, bool) -> None
+        """
+        :param name: name of the run
+        :param profile: if True, the run is also profiled with `cProfile`
+        :param trace_memory: if True, the peak memory is measured with `tracemalloc`
+        """
+        self.name = name
+        self.profile = profile
+        self.trace_memory = trace_memory
+
+        self.seconds = defaultdict(float)  # type: Dict[str, float]
+        self.calls = defaultdict(int)  # type: Dict[str, int]
+        self.counters = defaultdict(int)  # type: Dict[str, int]
+        self.wall_seconds = 0.0
+        self.peak_memory_mb = None  # type: Optional[float]
+
+        self._lock = threading.Lock()
+        self._t0 = None
+        self._cprofile = None  # type: Optional[cProfile.Profile]
+        self._profile_stats = None  # type: Optional[List[Dict]]
+        self._started_tracemalloc = False
+
+    def __enter__(self):
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+        if self.profile:
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+        self._t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.wall_seconds += time.perf_counter() - self._t0
+        if self._cprofile is not None:
+            self._cprofile.disable()
+            self._profile_stats = profile_summary(self._cprofile)
+            self._cprofile = None
+        if self.trace_memory and tracemalloc.is_tracing():
+            self.peak_memory_mb = tracemalloc.get_traced_memory()[1] / 2 ** 20
+            if self._started_tracemalloc:
+                tracemalloc.stop()
+                self._started_tracemalloc = False
+
+    def add(self, stage, seconds, calls=1):
+        # type: (str, float, int) -> None
+        """
+        Add `seconds` to the time spent in `stage`
+        """
+        with self._lock:
+            self.seconds[stage] += seconds
+            self.calls[stage] += calls
+
+    @contextmanager
+    def stage(self, stage):
+        # type: (str) -> Iterator[None]
+        """
+        Time the body of the `with` statement as part of `stage`
+        """
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - t0)
+
+    def timed(self, stage):
+        # type: (str) -> Callable
+        """
+        Decorator that times every call of the decorated function as part of `stage`
+        """
+
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.stage(stage):
+                    return fn(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def count(self, counter, n=1):
+        # type: (str, int) -> None
+        """
+        Increment `counter` by `n`
+        """
+        with self._lock:
+            self.counters[counter] += int(n)
+
+    def report(self):
+        # type: () -> Dict
+        """
+        :return: JSON-serializable report of the run
+        """
+        wall_seconds = self.wall_seconds
+        if self._t0 is not None and wall_seconds == 0.0:
+            # the run is still in progress
+            wall_seconds = time.perf_counter() - self._t0
+
+        with self._lock:
+            stages = {
+                stage: {
+                    'seconds': seconds,
+                    'calls': self.calls[stage],
+                    'share': seconds / wall_seconds if wall_seconds > 0 else None,
+                }
+                for stage, seconds in self.seconds.items()
+            }
+            counters = dict(self.counters)
+
+        report = {
+            'name': self.name,
+            'seconds': wall_seconds,
+            'stages': stages,
+            'counters': counters,
+            'throughput': {k: v / wall_seconds for k, v in counters.items()} if wall_seconds > 0 else {},
+        }
+        if self.trace_memory:
+            report['peak_memory_mb'] = self.peak_memory_mb
+        if self._profile_stats is not None:
+            report['profile'] = self._profile_stats
+        return report
+
+    def save(self, file_path):
+        # type: (str) -> str
+        """
+        Write the report of the run (see `report`) as JSON
+
+        :return: path of the report
+        """
+        with open(file_path, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+        return file_path
+
+    def summary(self):
+        # type: () -> str
+        """
+        :return: one-line human readable summary of the stages
+        """
+        stages = ', '.join(f'{k} {v:.2f}s' for k, v in sorted(self.seconds.items(), key=lambda kv: -kv[1]))
+        return f'{self.name}: {self.wall_seconds:.2f}s ({stages})'
+
+
+def profile_summary(profile, top_n=PROFILE_TOP_N):
+    # type: (cProfile.Profile, int) -> List[Dict]
+    """
+    :param profile: (disabled) cProfile profile
+    :param top_n: number of functions to keep
+    :return: the `top_n` functions with the highest cumulative time
+    """
+    stats = pstats.Stats(profile, stream=io.StringIO())
+    rows = []
+    for (file_name, line, fn_name), (cc, n_calls, tottime, cumtime, _) in stats.stats.items():
+        rows.append({
+            'function': f'{file_name}:{line}({fn_name})',
+            'calls': n_calls,
+            'tottime': tottime,
+            'cumtime': cumtime,
+        })
+    rows.sort(key=lambda r: -r['cumtime'])
+    return rows[:top_n]
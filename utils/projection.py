@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+# ---------------------
+
+import json
+import os
+from collections import namedtuple
+from typing import *
+
+import numpy as np
+
+from utils.geometry import CAMERA_FILE_NAME, DEFAULT_FRAME_SIZE, FrameSize, sequence_frame_size
+from utils.sequence_cache import JTA_DTYPE, load_sequence
+
+# 2D coordinates given to the joints behind the camera (never on screen)
+BEHIND_CAMERA = -1.
+
+
+class Intrinsics(namedtuple('Intrinsics', ['fx', 'fy', 'cx', 'cy', 'frame_size'])):
+    """
+    pinhole camera intrinsics [px] of the frames of a sequence: a joint with camera
+    coordinates (x, y, z) is projected to (fx * x / z + cx, fy * y / z + cy), with the
+    y axis pointing down, as in the JTA 3D coordinates; fx and fy can also be arrays
+    with one value per row of a sequence, if its camera zooms (see `sequence_intrinsics`)
+    """
+
+    __slots__ = ()
+
+    @staticmethod
+    def from_fov(fov, frame_size=DEFAULT_FRAME_SIZE):
+        # type: (float, FrameSize) -> Intrinsics
+        """
+        :param fov: vertical field of view [deg], as the `fov` column of `coords.csv`
+            (GTA camera field of view), or an array of them
+        :param frame_size: size of the frames
+        :return: intrinsics with square pixels, fx = fy = (height / 2) / tan(fov / 2),
+            and the principal point in the center of the frame
+        """
+        f = (frame_size.height / 2) / np.tan(np.radians(fov) / 2)
+        return Intrinsics(f, f, frame_size.width / 2, frame_size.height / 2, FrameSize(*frame_size))
+
+    @property
+    def fov(self):
+        # type: () -> Union[float, np.ndarray]
+        """
+        :return: vertical field of view [deg]
+        """
+        return np.degrees(2 * np.arctan((self.frame_size.height / 2) / self.fy))
+
+    def scaled(self, frame_size):
+        # type: (FrameSize) -> Intrinsics
+        """
+        :param frame_size: size of the resized frames
+        :return: intrinsics of the same camera with frames resized to `frame_size`
+        """
+        sx = frame_size.width / self.frame_size.width
+        sy = frame_size.height / self.frame_size.height
+        return Intrinsics(self.fx * sx, self.fy * sy, self.cx * sx, self.cy * sy, FrameSize(*frame_size))
+
+    def cropped(self, x_min, y_min, frame_size):
+        # type: (int, int, FrameSize) -> Intrinsics
+        """
+        :param x_min: left side of the crop [px]
+        :param y_min: top side of the crop [px]
+        :param frame_size: size of the crop
+        :return: intrinsics of the same camera with frames cropped to the required window
+        """
+        return Intrinsics(self.fx, self.fy, self.cx - x_min, self.cy - y_min, FrameSize(*frame_size))
+
+
+# intrinsics of the JTA camera (1920x1080 frames, 50 deg vertical field of view, the GTA default),
+# for the sequences whose `coords.csv` has no `fov`
+JTA_INTRINSICS = Intrinsics(1158., 1158., 960., 540., DEFAULT_FRAME_SIZE)
+
+
+def sequence_intrinsics(seq_dir, frames):
+    # type: (str, np.ndarray) -> Intrinsics
+    """
+    :param seq_dir: sequence folder
+    :param frames: frame number of each row of the sequence
+    :return: intrinsics of the camera of the sequence, from the field of view recorded
+        in its `coords.csv` (see `Intrinsics.from_fov`), or `JTA_INTRINSICS` if there is none;
+        if the field of view changes during the sequence, fx and fy have one value per row
+    """
+    from utils.annotation_handler import read_coords_fov
+
+    csv_path = os.path.join(seq_dir, 'coords.csv')
+    camera_fov = read_coords_fov(csv_path) if os.path.isfile(csv_path) else None
+    if camera_fov is None or len(camera_fov[0]) == 0:
+        return JTA_INTRINSICS
+
+    fov_frames, fov = camera_fov
+    frame_size = sequence_frame_size(seq_dir)
+    if np.all(fov == fov[0]):
+        return Intrinsics.from_fov(float(fov[0]), frame_size)
+
+    pos = np.minimum(np.searchsorted(fov_frames, frames), len(fov_frames) - 1)
+    if not np.array_equal(fov_frames[pos], frames):
+        raise ValueError(f'some frames of the sequence are not in \'{csv_path}\'')
+    return Intrinsics.from_fov(fov[pos], frame_size)
+
+
+def project(x3d, y3d, z3d, intrinsics=JTA_INTRINSICS):
+    # type: (np.ndarray, np.ndarray, np.ndarray, Intrinsics) -> Tuple[np.ndarray, np.ndarray]
+    """
+    :param x3d: x camera coordinate of each joint
+    :param y3d: y camera coordinate of each joint
+    :param z3d: z camera coordinate (depth) of each joint
+    :param intrinsics: intrinsics of the target camera
+    :return: 2D coordinates [px] of the joints; joints behind the camera get `BEHIND_CAMERA`
+    """
+    x3d, y3d, z3d = (np.asarray(c, dtype=np.float64) for c in (x3d, y3d, z3d))
+    in_front = z3d > 0
+    z = np.where(in_front, z3d, 1.)
+    x2d = np.where(in_front, intrinsics.fx * x3d / z + intrinsics.cx, BEHIND_CAMERA)
+    y2d = np.where(in_front, intrinsics.fy * y3d / z + intrinsics.cy, BEHIND_CAMERA)
+    return x2d, y2d
+
+
+def reproject_sequence(data, intrinsics):
+    # type: (np.ndarray, Intrinsics) -> np.ndarray
+    """
+    :param data: JTA sequence as a 2D array (one row per joint) or as `JTA_DTYPE` records
+    :param intrinsics: intrinsics of the target camera
+    :return: copy of the sequence (in the same layout and row order; 2D arrays as float64)
+        with the 2D coordinates of all the joints reprojected from their 3D coordinates, in a single pass
+    """
+    if data.dtype.names is not None:
+        records = np.array(data)
+        records['2D_x'], records['2D_y'] = project(records['3D_x'], records['3D_y'], records['3D_z'], intrinsics)
+        return records
+
+    data = np.array(data, dtype=np.float64)
+    data[:, 3], data[:, 4] = project(data[:, 5], data[:, 6], data[:, 7], intrinsics)
+    return data
+
+
+def reproject_json(json_path, out_path, intrinsics, data=None):
+    # type: (str, str, Intrinsics, Optional[np.ndarray]) -> str
+    """
+    Write the JTA JSON of a sequence reprojected to another camera (e.g. another resolution);
+    the intrinsics are saved in `CAMERA_FILE_NAME`, next to the output, so that the
+    conversions of the reprojected sequence use the right frame size (see `sequence_frame_size`).
+    NOTE: the output folder is the folder of the reprojected sequence, so it must differ from
+    the folder of `json_path`, whose frame size would otherwise be taken from the new camera
+
+    :param json_path: path of the JTA JSON of the sequence
+    :param out_path: path of the output JTA JSON, in another folder
+    :param intrinsics: intrinsics of the target camera; per-row fx and fy follow the rows of the JSON
+    :param data: rows of the JSON of `json_path`, if already read (see `load_sequence` with `use_cache=False`)
+    :return: path of the output JTA JSON
+    """
+    out_dir = os.path.dirname(os.path.abspath(out_path))
+    if out_dir == os.path.dirname(os.path.abspath(json_path)):
+        raise ValueError(f'the reprojected sequence must be written outside the folder of \'{json_path}\'')
+
+    # the float64 JSON (not the float32 cache), in its own row order
+    if data is None:
+        data = load_sequence(json_path, use_cache=False)
+    data = reproject_sequence(np.reshape(data, (-1, len(JTA_DTYPE.names))), intrinsics)
+
+    os.makedirs(out_dir, exist_ok=True)
+
+    # same layout as `csv_to_jta`: one [frame, pedestrian_id, ..., self_occluded] row per joint,
+    # with integer ids and 0/1 flags
+    columns = [data[:, i].astype(np.int64).tolist() if JTA_DTYPE[name].kind != 'f' else data[:, i].tolist()
+               for i, name in enumerate(JTA_DTYPE.names)]
+    with open(out_path, 'w') as f:
+        json.dump(list(zip(*columns)), f)
+
+    with open(os.path.join(out_dir, CAMERA_FILE_NAME), 'w') as f:
+        # per-row fx and fy (zooming camera) are saved as lists
+        json.dump({
+            'fx': np.asarray(intrinsics.fx).tolist(), 'fy': np.asarray(intrinsics.fy).tolist(),
+            'cx': intrinsics.cx, 'cy': intrinsics.cy,
+            'width': intrinsics.frame_size.width, 'height': intrinsics.frame_size.height,
+        }, f, indent=4)
+
+    return out_path
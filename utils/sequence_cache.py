@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+# ---------------------
+
+import json
+import os
+from typing import *
+
+import numpy as np
+
+# typed layout of a JTA sequence (one record per joint)
+JTA_DTYPE = np.dtype([
+    ('frame', '<i4'),
+    ('pedestrian_id', '<i4'),
+    ('joint_type', '<i4'),
+    ('2D_x', '<f4'),
+    ('2D_y', '<f4'),
+    ('3D_x', '<f4'),
+    ('3D_y', '<f4'),
+    ('3D_z', '<f4'),
+    ('occluded', '?'),
+    ('self_occluded', '?'),
+])
+
+# bump when the cache layout changes, to invalidate the existing caches
+CACHE_VERSION = 1
+
+
+def jta_columns(data):
+    # type: (np.ndarray) -> List[np.ndarray]
+    """
+    :param data: JTA sequence as a 2D array or as an array of `JTA_DTYPE` records
+    :return: the 10 JTA columns of `data` (views, no copies)
+    """
+    if data.dtype.names is not None:
+        return [data[name] for name in data.dtype.names]
+    return [data[:, i] for i in range(data.shape[1])]
+
+
+def to_records(data):
+    # type: (np.ndarray) -> np.ndarray
+    """
+    :param data: JTA sequence as a 2D array (one row per joint)
+    :return: the sequence as `JTA_DTYPE` records, sorted by (frame, pedestrian_id, joint_type)
+    """
+    data = np.asarray(data).reshape(-1, len(JTA_DTYPE.names))
+    records = np.empty(len(data), dtype=JTA_DTYPE)
+    for i, name in enumerate(JTA_DTYPE.names):
+        records[name] = data[:, i]
+
+    order = np.lexsort((records['joint_type'], records['pedestrian_id'], records['frame']))
+    return records[order]
+
+
+def cache_paths(json_path, cache_dir=None):
+    # type: (str, Optional[str]) -> Tuple[str, str]
+    """
+    :param json_path: path of the JTA JSON of the sequence (e.g. `seq_3.json`)
+    :param cache_dir: folder of the cache; default: the folder of `json_path`
+    :return: paths of the cached array (`.jta.npy`) and of its key file (`.jta.meta`)
+    """
+    folder, name = os.path.split(str(json_path))
+    base = os.path.join(cache_dir if cache_dir is not None else folder, os.path.splitext(name)[0])
+    return base + '.jta.npy', base + '.jta.meta'
+
+
+def source_key(json_path):
+    # type: (str) -> Dict
+    """
+    :return: key identifying the current version of the source file
+    """
+    stat = os.stat(str(json_path))
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'version': CACHE_VERSION}
+
+
+def is_cache_valid(json_path, cache_dir=None):
+    # type: (str, Optional[str]) -> bool
+    """
+    :return: True if the cache of `json_path` exists and is up to date
+    """
+    npy_path, meta_path = cache_paths(json_path, cache_dir)
+    if not (os.path.isfile(npy_path) and os.path.isfile(meta_path)):
+        return False
+    with open(meta_path, 'r') as f:
+        try:
+            return json.load(f) == source_key(json_path)
+        except ValueError:
+            return False
+
+
+def build_cache(json_path, cache_dir=None):
+    # type: (str, Optional[str]) -> str
+    """
+    Conversion of the JTA JSON of a sequence to the binary cache
+
+    :return: path of the cached array
+    """
+    npy_path, meta_path = cache_paths(json_path, cache_dir)
+    key = source_key(json_path)
+
+    with open(json_path, 'r') as json_file:
+        records = to_records(np.array(json.load(json_file), dtype=np.float64))
+
+    # write to temporary files first: a half-written cache is never valid
+    with open(npy_path + '.tmp', 'wb') as f:
+        np.save(f, records)
+    os.replace(npy_path + '.tmp', npy_path)
+
+    with open(meta_path + '.tmp', 'w') as f:
+        json.dump(key, f)
+    os.replace(meta_path + '.tmp', meta_path)
+
+    return npy_path
+
+
+def load_sequence(json_path, cache_dir=None, use_cache=True):
+    # type: (str, Optional[str], bool) -> np.ndarray
+    """
+    :param json_path: path of the JTA JSON of the sequence
+    :param cache_dir: folder of the cache; default: the folder of `json_path`
+    :param use_cache: if False, the JSON is parsed as before and returned as a 2D float array
+    :return: read-only memory map of the sequence as `JTA_DTYPE` records,
+        sorted by (frame, pedestrian_id, joint_type); the cache is (re)built if needed
+    """
+    if not use_cache:
+        with open(json_path, 'r') as json_file:
+            return np.array(json.load(json_file))
+
+    if not is_cache_valid(json_path, cache_dir):
+        build_cache(json_path, cache_dir)
+
+    npy_path, _ = cache_paths(json_path, cache_dir)
+    try:
+        return np.load(npy_path, mmap_mode='r')
+    except ValueError:
+        # empty sequences cannot be memory-mapped
+        return np.load(npy_path)
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+# ---------------------
+
+from typing import *
+
+import numpy as np
+
+from utils.ann_visualization.pose import Pose
+from utils.ann_visualization.pose_batch import PoseBatch
+from utils.geometry import DEFAULT_FRAME_SIZE, FrameSize
+from utils.sequence_cache import jta_columns
+
+
+def is_sorted_by_pose(frame, person_id, joint_type):
+    # type: (np.ndarray, np.ndarray, np.ndarray) -> bool
+    """
+    :return: True if the rows are already sorted by (frame, person_id, joint_type)
+    """
+    df, dp, dt = np.diff(frame), np.diff(person_id), np.diff(joint_type)
+    return bool(np.all((df > 0) | ((df == 0) & ((dp > 0) | ((dp == 0) & (dt >= 0))))))
+
+
+def split_frames(first_frame, stop_frame, n_chunks):
+    # type: (int, int, int) -> List[Tuple[int, int]]
+    """
+    :return: up to `n_chunks` contiguous and ordered ranges [start, stop) covering [first_frame, stop_frame)
+    """
+    bounds = np.linspace(first_frame, stop_frame, max(1, n_chunks) + 1).round().astype(int)
+    return [(int(a), int(b)) for a, b in zip(bounds[:-1], bounds[1:]) if b > a]
+
+
+def select_frames(frame_ids, frame_stride=1, max_frames=None):
+    # type: (np.ndarray, int, Optional[int]) -> List[int]
+    """
+    :param frame_ids: (sorted) numbers of the frames with data
+    :param frame_stride: only one frame every `frame_stride` frames is kept
+    :param max_frames: if given, at most `max_frames` frames (evenly spaced) are kept
+    :return: numbers of the frames to convert
+    """
+    frames = frame_ids[::frame_stride]
+    if max_frames is not None and len(frames) > max_frames:
+        frames = frames[np.linspace(0, len(frames) - 1, max_frames).round().astype(int)]
+    return frames.tolist()
+
+
+class SequenceIndex(object):
+    """
+    a SequenceIndex groups the rows of a JTA sequence array by frame and by
+    (frame, person_id) with a single sort; every frame or person lookup is
+    then a zero-copy slice of the sorted array.
+    """
+
+    def __init__(self, data, frame_size=DEFAULT_FRAME_SIZE):
+        # type: (np.ndarray, FrameSize) -> None
+        """
+        :param data: JTA array with one row per joint, or `JTA_DTYPE` records (see `PoseBatch`);
+            if already sorted (e.g. a cached sequence), `data` is indexed in place
+        :param frame_size: size of the frames of the sequence (given to the poses)
+        """
+        self.frame_size = frame_size
+
+        data = np.asarray(data)
+        if data.dtype.names is None and data.ndim != 2:
+            data = data.reshape(-1, 10)
+
+        frame, person_id, joint_type = [c.astype(np.int64) for c in jta_columns(data)[:3]]
+
+        if not is_sorted_by_pose(frame, person_id, joint_type):
+            order = np.lexsort((joint_type, person_id, frame))
+            data = data[order]
+            frame, person_id = frame[order], person_id[order]
+
+        self.data = data
+
+        # frame offsets
+        self.frame_ids, self.frame_starts = np.unique(frame, return_index=True)
+        self.frame_stops = np.append(self.frame_starts[1:], len(data))
+
+        # (frame, person) offsets
+        new_person = np.ones(len(data), dtype=bool)
+        new_person[1:] = (frame[1:] != frame[:-1]) | (person_id[1:] != person_id[:-1])
+        self.person_starts = np.flatnonzero(new_person)
+        self.person_stops = np.append(self.person_starts[1:], len(data))
+        self.person_frames = frame[self.person_starts]
+        self.person_id_values = person_id[self.person_starts]
+
+    def __len__(self):
+        # type: () -> int
+        return len(self.frame_ids)
+
+    def __contains__(self, frame_number):
+        # type: (int) -> bool
+        return self._frame_pos(frame_number) is not None
+
+    def __iter__(self):
+        # type: () -> Iterator[Tuple[int, np.ndarray]]
+        """
+        :return: iterator over (frame_number, frame_data) of the populated frames
+        """
+        for frame_number, start, stop in zip(self.frame_ids.tolist(), self.frame_starts, self.frame_stops):
+            yield frame_number, self.data[start:stop]
+
+    @property
+    def n_frames(self):
+        # type: () -> int
+        """
+        :return: number of frames of the sequence (last frame number + 1)
+        """
+        return int(self.frame_ids[-1]) + 1 if len(self.frame_ids) > 0 else 0
+
+    def _frame_pos(self, frame_number):
+        # type: (int) -> Optional[int]
+        pos = int(np.searchsorted(self.frame_ids, frame_number))
+        if pos < len(self.frame_ids) and self.frame_ids[pos] == frame_number:
+            return pos
+        return None
+
+    def frame(self, frame_number):
+        # type: (int) -> np.ndarray
+        """
+        :param frame_number: frame number
+        :return: view on the rows of the required frame (empty if the frame has no data)
+        """
+        pos = self._frame_pos(frame_number)
+        if pos is None:
+            return self.data[:0]
+        return self.data[self.frame_starts[pos]:self.frame_stops[pos]]
+
+    def rows(self, first_frame, stop_frame):
+        # type: (int, int) -> Tuple[int, int]
+        """
+        :return: range [start, stop) of the rows of the sorted array (`self.data`)
+            belonging to the frames in [first_frame, stop_frame)
+        """
+        lo, hi = np.searchsorted(self.frame_ids, [first_frame, stop_frame])
+        start = int(self.frame_starts[lo]) if lo < len(self.frame_ids) else len(self.data)
+        stop = int(self.frame_starts[hi]) if hi < len(self.frame_ids) else len(self.data)
+        return start, stop
+
+    def _person_range(self, frame_number):
+        # type: (int) -> Tuple[int, int]
+        """
+        :return: range of the (frame, person) groups belonging to the required frame
+        """
+        lo = int(np.searchsorted(self.person_frames, frame_number, side='left'))
+        hi = int(np.searchsorted(self.person_frames, frame_number, side='right'))
+        return lo, hi
+
+    def person_ids(self, frame_number):
+        # type: (int) -> np.ndarray
+        """
+        :param frame_number: frame number
+        :return: sorted identifiers of the people in the required frame
+        """
+        lo, hi = self._person_range(frame_number)
+        return self.person_id_values[lo:hi]
+
+    def person(self, frame_number, person_id):
+        # type: (int, int) -> np.ndarray
+        """
+        :param frame_number: frame number
+        :param person_id: person identifier
+        :return: view on the rows of the required person in the required frame,
+            sorted by joint type (empty if the person is not in the frame)
+        """
+        lo, hi = self._person_range(frame_number)
+        pos = lo + int(np.searchsorted(self.person_id_values[lo:hi], person_id))
+        if pos < hi and self.person_id_values[pos] == person_id:
+            return self.data[self.person_starts[pos]:self.person_stops[pos]]
+        return self.data[:0]
+
+    def poses(self, frame_number):
+        # type: (int) -> PoseBatch
+        """
+        :param frame_number: frame number
+        :return: all the poses of the required frame
+        """
+        return PoseBatch(self.frame(frame_number), presorted=True, frame_size=self.frame_size)
+
+    def pose(self, frame_number, person_id):
+        # type: (int, int) -> Pose
+        """
+        :param frame_number: frame number
+        :param person_id: person identifier
+        :return: pose of the required person in the required frame
+        """
+        return PoseBatch(self.person(frame_number, person_id), presorted=True, frame_size=self.frame_size).pose(0)
@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+# ---------------------
+
+import csv
+from typing import *
+
+import numpy as np
+
+from utils.ann_visualization.pose_batch import PoseBatch
+from utils.geometry import DEFAULT_FRAME_SIZE, FrameSize
+from utils.sequence_cache import jta_columns
+from utils.sequence_index import is_sorted_by_pose
+
+# columns of `TrackIndex.summary`
+TRACK_SUMMARY_COLUMNS = ('person_id', 'first_frame', 'last_frame', 'n_frames', 'first_visible_frame',
+                         'last_visible_frame', 'occlusion_ratio')
+
+
+class TrackIndex(object):
+    """
+    a TrackIndex groups the rows of a JTA sequence array by person (track) and,
+    within a track, by frame, with a single sort: the rows, poses and boxes of a
+    track are zero-copy slices, and every track query costs O(track length).
+    Joints that are not on screen count as occluded, as in the exporters.
+    """
+
+    def __init__(self, data, frame_size=DEFAULT_FRAME_SIZE):
+        # type: (np.ndarray, FrameSize) -> None
+        """
+        :param data: JTA array with one row per joint, or `JTA_DTYPE` records (see `PoseBatch`)
+        :param frame_size: size of the frames of the sequence
+        """
+        self.frame_size = frame_size
+
+        data = np.asarray(data)
+        if data.dtype.names is None and data.ndim != 2:
+            data = data.reshape(-1, 10)
+
+        frame, person_id, joint_type = [c.astype(np.int64) for c in jta_columns(data)[:3]]
+        if not is_sorted_by_pose(person_id, frame, joint_type):
+            data = data[np.lexsort((joint_type, frame, person_id))]
+
+        self.data = data
+
+        # one pose per (person, frame), in track order
+        self.poses = PoseBatch(data, presorted=True, frame_size=frame_size)
+        self.poses.handle_joints_not_on_screen()
+        self.pose_frames = self.poses.frames
+        self.pose_bboxes = self.poses.bbox_2d
+        self.pose_visible = ~self.poses.invisible
+
+        # track offsets (in poses and in rows)
+        self.person_ids, self.track_starts = np.unique(self.poses.person_ids, return_index=True)
+        self.track_stops = np.append(self.track_starts[1:], len(self.poses))
+        self.row_starts = self.poses.starts[self.track_starts]
+        self.row_stops = np.append(self.row_starts[1:], len(data))
+
+        # per-track occluded and total joints
+        if len(self.person_ids) > 0:
+            self.track_n_occluded = np.add.reduceat(self.poses.n_occluded, self.track_starts)
+            self.track_n_joints = np.add.reduceat(self.poses.counts, self.track_starts)
+        else:
+            self.track_n_occluded = self.track_n_joints = np.zeros(0, dtype=np.int64)
+
+    def __len__(self):
+        # type: () -> int
+        return len(self.person_ids)
+
+    def __contains__(self, person_id):
+        # type: (int) -> bool
+        return self._track_pos(person_id) is not None
+
+    def __iter__(self):
+        # type: () -> Iterator[Tuple[int, np.ndarray]]
+        """
+        :return: iterator over (person_id, track_data) of all the tracks
+        """
+        for person_id, start, stop in zip(self.person_ids.tolist(), self.row_starts, self.row_stops):
+            yield person_id, self.data[start:stop]
+
+    def _track_pos(self, person_id):
+        # type: (int) -> Optional[int]
+        pos = int(np.searchsorted(self.person_ids, person_id))
+        if pos < len(self.person_ids) and self.person_ids[pos] == person_id:
+            return pos
+        return None
+
+    def _poses_range(self, person_id):
+        # type: (int) -> Tuple[int, int]
+        """
+        :return: range [start, stop) of the poses of the required track (empty if unknown)
+        """
+        pos = self._track_pos(person_id)
+        if pos is None:
+            return 0, 0
+        return int(self.track_starts[pos]), int(self.track_stops[pos])
+
+    def track(self, person_id):
+        # type: (int) -> np.ndarray
+        """
+        :param person_id: person identifier
+        :return: view on the rows of the required person, sorted by (frame, joint type)
+            (empty if the person is not in the sequence)
+        """
+        pos = self._track_pos(person_id)
+        if pos is None:
+            return self.data[:0]
+        return self.data[self.row_starts[pos]:self.row_stops[pos]]
+
+    def frames(self, person_id):
+        # type: (int) -> np.ndarray
+        """
+        :param person_id: person identifier
+        :return: sorted numbers of the frames in which the person appears
+        """
+        start, stop = self._poses_range(person_id)
+        return self.pose_frames[start:stop]
+
+    def bboxes(self, person_id):
+        # type: (int) -> np.ndarray
+        """
+        :param person_id: person identifier
+        :return: (n_frames, 4) bounding boxes of the person in format [x_min, y_min, x_max, y_max],
+            one for each of its `frames`
+        """
+        start, stop = self._poses_range(person_id)
+        return self.pose_bboxes[start:stop]
+
+    def trajectory(self, person_id, joint_type=None, in_3d=False):
+        # type: (int, Optional[int], bool) -> Tuple[np.ndarray, np.ndarray]
+        """
+        :param person_id: person identifier
+        :param joint_type: joint to follow; default: the mean of all the joints of each pose
+        :param in_3d: if True, the 3D camera coordinates are returned instead of the 2D ones
+        :return: (frames, points): frame numbers and (n, 2) or (n, 3) coordinates of the person
+        """
+        pos = self._track_pos(person_id)
+        if pos is None:
+            return np.zeros(0, dtype=np.int64), np.zeros((0, 3 if in_3d else 2))
+
+        r0, r1 = int(self.row_starts[pos]), int(self.row_stops[pos])
+        poses = self.poses
+        coords = (poses.x3d, poses.y3d, poses.z3d) if in_3d else (poses.x2d, poses.y2d)
+        coords = np.stack([c[r0:r1] for c in coords], axis=1).astype(np.float64)
+
+        if joint_type is not None:
+            mask = poses.type[r0:r1] == joint_type
+            return poses.frame[r0:r1][mask], coords[mask]
+
+        p0, p1 = int(self.track_starts[pos]), int(self.track_stops[pos])
+        counts = poses.counts[p0:p1]
+        points = np.add.reduceat(coords, poses.starts[p0:p1] - r0, axis=0) / counts[:, None]
+        return self.pose_frames[p0:p1], points
+
+    def lifespan(self, person_id):
+        # type: (int) -> Optional[Tuple[int, int]]
+        """
+        :param person_id: person identifier
+        :return: first and last frame in which the person appears (None if unknown)
+        """
+        start, stop = self._poses_range(person_id)
+        if start == stop:
+            return None
+        return int(self.pose_frames[start]), int(self.pose_frames[stop - 1])
+
+    def visible_frames(self, person_id):
+        # type: (int) -> np.ndarray
+        """
+        :param person_id: person identifier
+        :return: sorted numbers of the frames in which at least one joint of the person is visible
+        """
+        start, stop = self._poses_range(person_id)
+        return self.pose_frames[start:stop][self.pose_visible[start:stop]]
+
+    def first_visible_frame(self, person_id):
+        # type: (int) -> Optional[int]
+        """
+        :return: first frame in which the person is visible (None if never visible)
+        """
+        start, stop = self._poses_range(person_id)
+        visible = np.flatnonzero(self.pose_visible[start:stop])
+        return int(self.pose_frames[start + visible[0]]) if len(visible) > 0 else None
+
+    def last_visible_frame(self, person_id):
+        # type: (int) -> Optional[int]
+        """
+        :return: last frame in which the person is visible (None if never visible)
+        """
+        start, stop = self._poses_range(person_id)
+        visible = np.flatnonzero(self.pose_visible[start:stop])
+        return int(self.pose_frames[start + visible[-1]]) if len(visible) > 0 else None
+
+    def occlusion_ratio(self, person_id):
+        # type: (int) -> Optional[float]
+        """
+        :return: fraction of the joints of the track that are occluded (None if unknown)
+        """
+        pos = self._track_pos(person_id)
+        if pos is None:
+            return None
+        return float(self.track_n_occluded[pos] / self.track_n_joints[pos])
+
+    def summary(self):
+        # type: () -> List[Tuple]
+        """
+        :return: one row per track, with columns `TRACK_SUMMARY_COLUMNS`
+        """
+        rows = []
+        for person_id in self.person_ids.tolist():
+            first_frame, last_frame = self.lifespan(person_id)
+            start, stop = self._poses_range(person_id)
+            rows.append((person_id, first_frame, last_frame, stop - start, self.first_visible_frame(person_id),
+                         self.last_visible_frame(person_id), self.occlusion_ratio(person_id)))
+        return rows
+
+
+def write_track_summary(index, out_path):
+    # type: (TrackIndex, str) -> str
+    """
+    :param index: tracks of a sequence
+    :param out_path: path of the output CSV, with one row per track (see `TrackIndex.summary`)
+    :return: path of the output CSV
+    """
+    with open(out_path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(TRACK_SUMMARY_COLUMNS)
+        writer.writerows(index.summary())
+    return out_path